@@ -1,96 +1,197 @@
 import os
 import sys
-import configparser
-import traceback
-# --- Core Imports ---
-from ivoryos.utils.global_config import GlobalConfig
-from plugin.app import plugin as plugin_blueprint
-import ivoryos
-# --- Hardware + Communication ---
-from comms.commands import COMMANDS
-from comms.wifi_handler import WifiHandler, BASE_HTTP_URL, WS_URL
-from comms.serial_handler import SerialHandler
-from hardware_modules.robot import Robot
-from hardware_modules.pump import Pump
-from hardware_modules.sonicator import Sonicator
-from hardware_modules.hotplate import Hotplate
+import time
+import logging
+import argparse
+from comms import fast_ini
+from comms.ram_cache import cached_path
+# Heavy imports (ivoryos/Flask, pyserial, websocket-client, hardware modules)
+# are deferred until the config has selected what is actually needed.
 # --- Constants ---
 CONFIG_FILE = 'config.ini'
 LOCATIONS_FILE = 'locations.json'
 INIT_GCODE_FILE = 'robot_init.gcode'
+# Module providing the IvoryOS blueprint as `plugin`; set MINIMALEE_PLUGIN= (empty) to run without it
+PLUGIN_MODULE = os.environ.get('MINIMALEE_PLUGIN', 'plugin.app')
+
+
+def _build_handler(comm_mode, config):
+    """Builds the handler for the configured comm mode; only its import chain is loaded."""
+    from comms.commands import COMMANDS
+    if comm_mode == 'serial':
+        from comms.serial_handler import SerialHandler
+        return SerialHandler(
+            port=config.get('Connection', 'serial_port'),
+            baudrate=config.getint('Connection', 'baud_rate'),
+            commands_dict=COMMANDS,
+            inflight_limit=config.getint('Connection', 'inflight_limit', fallback=4)
+        )
+    if comm_mode == 'wifi':
+        from comms.wifi_handler import WifiHandler, BASE_HTTP_URL, WS_URL
+        return WifiHandler(
+            http_url=BASE_HTTP_URL,
+            ws_url=WS_URL,
+            commands_dict=COMMANDS,
+            ws_send=config.getboolean('Connection', 'ws_send', fallback=False),
+            inflight_limit=config.getint('Connection', 'inflight_limit', fallback=4)
+        )
+    raise ValueError(f"Invalid comm mode '{comm_mode}'. Use 'wifi' or 'serial'.")
+
+
+def _build_devices(handler, config):
+    """Imports and instantiates the hardware modules once the handler is connected."""
+    from hardware_modules.robot import Robot
+    from hardware_modules.pump import Pump
+    from hardware_modules.sonicator import Sonicator
+    from hardware_modules.hotplate import Hotplate
+
+    robot = Robot(
+        communicator=handler,
+        safe_z=config.getfloat('Robot', 'safe_z', fallback=100.0),
+        default_speed=config.getfloat('Robot', 'default_speed', fallback=3000.0),
+        locations_filepath=LOCATIONS_FILE,
+        init_gcode_filepath=INIT_GCODE_FILE
+    )
+    pump = Pump(comms=handler, mm_per_ml=config.getfloat('Pump', 'mm_per_ml', fallback=1.0),
+                max_feedrate_mm_min=config.getfloat('Pump', 'max_feedrate_mm_min', fallback=None))
+    sonicator = Sonicator(comms=handler)
+    hotplate = Hotplate(comms=handler, max_temp=config.getfloat('Hotplate', 'max_temp', fallback=150.0))
+    return robot, pump, sonicator, hotplate
+
+
+def _run_gui(handler, robot, pump, sonicator, hotplate, use_plugin=True):
+    """Registers the devices on the ivoryos deck and blocks serving the GUI."""
+    from ivoryos.utils.global_config import GlobalConfig
+    global_config = GlobalConfig()
+    if global_config.deck is None:
+        class DeckPlaceholder:
+            __name__ = __name__
+            __file__ = __file__
+        global_config.deck = DeckPlaceholder()
+
+    global_config.deck.handler = handler
+    global_config.deck.robot = robot
+    global_config.deck.pump = pump
+    global_config.deck.sonicator = sonicator
+    global_config.deck.hotplate = hotplate
+
+    import ivoryos
+    if not (use_plugin and PLUGIN_MODULE):
+        ivoryos.run(__name__); return
+    import importlib
+    plugin_blueprint = importlib.import_module(PLUGIN_MODULE).plugin # Flask blueprint chain loads only here
+    ivoryos.run(__name__, blueprint_plugins=plugin_blueprint)
+
+
+def cmd_pump_test(args, handler, pump):
+    """Runs a short pump sequence against the connected hardware (formerly test_pump.py)."""
+    print("\n--- Running Pump Tests ---")
+
+    print(f"\n--- Test 1: Pump Volume ({args.volume} mL at {args.rate} mL/min) ---")
+    pump.pump_volume(volume_ml=args.volume, flowrate_ml_min=args.rate)
+    time.sleep(1) # Small pause between tests for observation
+
+    print(f"\n--- Test 2: Pump Duration ({args.duration} s at {-args.rate} mL/min) ---")
+    pump.pump_duration(duration_s=args.duration, flowrate_ml_min=-args.rate) # Pump backwards
+    time.sleep(1)
+
+    print("\n--- Test 3: Pump Zero Volume ---")
+    pump.pump_volume(volume_ml=0, flowrate_ml_min=args.rate) # Should do nothing but warn
+
+    print("\n--- Pump Testing Finished ---")
+
+
+def _shutdown(handler, hotplate):
+    """Turns the hotbed off and closes the connection; safe to call after a GUI crash."""
+    print("--- Shutting down: turning hotplate off and disconnecting ---")
+    try:
+        hotplate.turn_off()
+    except Exception as e:
+        print(f"Warning: could not turn hotplate off: {e}")
+    handler.disconnect()
+
+
+def _setup_logging(verbose):
+    """
+    Routes log records through a QueueHandler, so handler threads (e.g. the -vv per-line
+    trace in the wait loops) only enqueue; a QueueListener thread does the console writes.
+    """
+    import atexit
+    import queue
+    from logging.handlers import QueueHandler, QueueListener
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s', datefmt='%H:%M:%S'))
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, console)
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter('%(message)s')) # Only merges args; the listener adds the layout
+    logging.basicConfig(level=(logging.WARNING, logging.INFO, logging.DEBUG)[min(verbose, 2)],
+                        handlers=[queue_handler])
+    listener.start()
+    atexit.register(listener.stop) # Flushes queued records on exit
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Minimalee robot control with IvoryOS")
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help="-v logs INFO messages, -vv also every received line (default: warnings and errors only)")
+    subparsers = parser.add_subparsers(dest='command')
+    gui_parser = subparsers.add_parser('gui', help="Launch the IvoryOS GUI (default)")
+    gui_parser.add_argument('--no-plugin', action='store_true', help="Launch IvoryOS without the control plugin")
+    pump_parser = subparsers.add_parser('pump-test', help="Run a short pump test sequence and exit")
+    pump_parser.add_argument('--volume', type=float, default=2.0, help="Volume for the volume test in mL")
+    pump_parser.add_argument('--rate', type=float, default=5.0,
+                             help="Flowrate magnitude in mL/min (rate x mm_per_ml must not exceed [Pump] max_feedrate_mm_min)")
+    pump_parser.add_argument('--duration', type=float, default=5.0, help="Duration for the duration test in s")
+    args = parser.parse_args()
+    command = args.command or 'gui'
+    _setup_logging(args.verbose)
+
     print("--- Starting Nichols Bot Control ---")
-    
+
     # Load config
-    config = configparser.ConfigParser(inline_comment_prefixes=';')
     if not os.path.exists(CONFIG_FILE):
         print(f"Config file '{CONFIG_FILE}' not found. Exiting.")
         sys.exit(1)
-    config.read(CONFIG_FILE)
-    
+    config = fast_ini.load(cached_path(CONFIG_FILE)) # RAM-disk mirror if MINIMALEE_RAMDISK is set
+
     # Communication Mode
     comm_mode = config.get('Connection', 'mode', fallback='wifi').lower()
     handler = None
-    
+
     try:
-        if comm_mode == 'serial':
-            handler = SerialHandler(
-                port=config.get('Connection', 'serial_port'),
-                baudrate=config.getint('Connection', 'baud_rate'),
-                commands_dict=COMMANDS
-            )
-        elif comm_mode == 'wifi':
-            handler = WifiHandler(
-                http_url=BASE_HTTP_URL,
-                ws_url=WS_URL,
-                commands_dict=COMMANDS
-            )
-        else:
-            print(f"Invalid comm mode '{comm_mode}'. Use 'wifi' or 'serial'.")
-            sys.exit(1)
-        
-        # Instantiate hardware
-        robot = Robot(
-            communicator=handler,
-            safe_z=config.getfloat('Robot', 'safe_z', fallback=100.0),
-            default_speed=config.getfloat('Robot', 'default_speed', fallback=3000.0),
-            locations_filepath=LOCATIONS_FILE,
-            init_gcode_filepath=INIT_GCODE_FILE
-        )
-        pump = Pump(comms=handler, mm_per_ml=config.getfloat('Pump', 'mm_per_ml', fallback=1.0))
-        sonicator = Sonicator(comms=handler)
-        hotplate = Hotplate(comms=handler, max_temp=config.getfloat('Hotplate', 'max_temp', fallback=150.0))
-        
+        handler = _build_handler(comm_mode, config)
+
         # Connect and configure
         if not handler.connect():
             print("Failed to connect to handler.")
             sys.exit(1)
-        
+
+        # Instantiate hardware
+        robot, pump, sonicator, hotplate = _build_devices(handler, config)
+
+        if command == 'pump-test':
+            try:
+                cmd_pump_test(args, handler, pump)
+            except KeyboardInterrupt:
+                print("\nKeyboard interrupt detected. Disconnecting...")
+            finally:
+                handler.disconnect()
+            sys.exit(0)
+
         if not robot.apply_initial_config():
             print("Failed to apply robot config.")
             handler.disconnect()
             sys.exit(1)
-        
-        # Assign to global_config
-        global_config = GlobalConfig()
-        if global_config.deck is None:
-            class DeckPlaceholder:
-                __name__ = __name__
-                __file__ = __file__
-            global_config.deck = DeckPlaceholder()
-        
-        global_config.deck.handler = handler
-        global_config.deck.robot = robot
-        global_config.deck.pump = pump
-        global_config.deck.sonicator = sonicator
-        global_config.deck.hotplate = hotplate
-        
-        # Run IvoryOS with plugin
+
+        # Run IvoryOS; the deck must stay in this process
         print("--- Initialization successful. Launching IvoryOS ---")
-        ivoryos.run(__name__, blueprint_plugins=plugin_blueprint)
-        
+        try:
+            _run_gui(handler, robot, pump, sonicator, hotplate, use_plugin=not getattr(args, 'no_plugin', False))
+        finally:
+            _shutdown(handler, hotplate) # GUI exited or crashed: leave the hardware safe
+
     except Exception as e:
         print(f"Error: {e}")
-        traceback.print_exc()
-        sys.exit(1)
\ No newline at end of file
+        import traceback; traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,31 @@
+"""
+Communication handlers for the G-code interpreter.
+
+Handler classes are resolved lazily on first attribute access (PEP 562), so
+`from comms import WifiHandler` only loads websocket-client/requests and
+`from comms import SerialHandler` only loads pyserial.
+"""
+import importlib
+
+_LAZY_ATTRS = {
+    "COMMANDS": ".commands",
+    "BaseGcodeHandler": ".base_handler",
+    "CommsProtocol": ".base_handler",
+    "SerialHandler": ".serial_handler",
+    "WifiHandler": ".wifi_handler",
+}
+
+__all__ = list(_LAZY_ATTRS)
+
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value # Cache so later lookups skip __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
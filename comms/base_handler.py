@@ -0,0 +1,355 @@
+# comms/base_handler.py
+import abc
+import time
+import queue
+import typing
+import threading
+import concurrent.futures
+from .commands import build_specs
+from .message_buffer import MessageBuffer
+
+_CLOSED = object() # Put on message_queue by the reader/receiver thread when it exits, to wake any waiter
+
+_ts_cache = (None, "") # (whole second, its '%H:%M:%S'); swapped as one tuple so reader threads never see half an update
+
+
+def _now_hms() -> str:
+    """Wall-clock '%H:%M:%S' for the console trace, formatted at most once per second."""
+    global _ts_cache
+    now = int(time.time())
+    if now != _ts_cache[0]: _ts_cache = (now, time.strftime('%H:%M:%S', time.localtime(now)))
+    return _ts_cache[1]
+
+
+@typing.runtime_checkable
+class CommsProtocol(typing.Protocol):
+    """
+    Every handler member Robot, Pump and Hotplate use. isinstance() checks only that these
+    attributes exist, so the modules validate a handler without importing its transport.
+    """
+    message_queue: MessageBuffer
+    inflight_limit: int
+    is_connected: bool
+
+    def send_command(self, command_key: str, **kwargs) -> bool: ...
+
+    def send_command_async(self, command_key: str, **kwargs) -> concurrent.futures.Future: ...
+
+    def send_raw_gcode(self, gcode_string: str, encoded: bytes | None = None) -> bool: ...
+
+    def send_batch(self, steps) -> bool: ...
+
+    def drain(self) -> bool: ...
+
+    def register_line_matcher(self, pattern, callback): ...
+
+    def unregister_line_matcher(self, token): ...
+
+
+class BaseGcodeHandler(abc.ABC):
+    """
+    Transport-independent half of a G-code handler: command lookup and formatting,
+    the in-flight window, the received-line queue and the send_command / send_batch
+    state machine. Subclasses provide the connection, _send() and _wait_for_command().
+    """
+
+    DEFAULT_INFLIGHT_TIMEOUT = 10.0 # Max seconds to wait for outstanding 'ok's before giving up on them
+
+    def __init__(self, commands_dict, inflight_limit: int = 4):
+        """
+        Args:
+            commands_dict (Mapping): Mapping defining G-code commands and wait behavior (read-only, e.g. COMMANDS).
+            inflight_limit (int): Max lines sent without waiting that may still be awaiting their 'ok'
+                                  (should not exceed the firmware command buffer, Marlin BUFSIZE). Defaults to 4.
+        """
+        self.commands = commands_dict
+        self._specs = build_specs(commands_dict) # command_key -> CmdSpec, resolved once
+        # Parameter-free commands that don't wait skip straight to one write in send_command
+        self._fast = {key: spec for key, spec in self._specs.items() if spec.encoded and not spec.wait_after}
+        self._m400_gcode = commands_dict.get("wait_finish", {}).get("gcode")
+        self.is_connected = False
+        self.message_queue = MessageBuffer() # Bounded FIFO of received lines
+        # Pre-fetch window: fire-and-forget lines are streamed until inflight_limit are unacknowledged
+        self.inflight_limit = max(1, int(inflight_limit))
+        self._inflight = 0
+        self._owed_oks = 0 # 'ok's still due for lines given up on at a window timeout; swallowed on arrival
+        self._inflight_cv = threading.Condition()
+        self._executor = None # Created on first send_command_async
+        # Held for a whole send + wait: callers on different threads (GUI, async worker) share one reply queue
+        self._send_lock = threading.RLock()
+        # (pattern, callback) pairs; the tuple is replaced, never mutated, so the reader iterates it without locking
+        self._line_matchers = ()
+        self._matchers_lock = threading.Lock()
+
+    # --- Transport hooks ---
+    @abc.abstractmethod
+    def connect(self) -> bool: ...
+
+    @abc.abstractmethod
+    def disconnect(self): ...
+
+    @abc.abstractmethod
+    def _send(self, gcode_command: str, encoded: bytes | None = None) -> bool:
+        """Writes one or more newline-joined G-code lines (encoded: their precomputed wire bytes, if known)."""
+
+    @abc.abstractmethod
+    def _wait_for_command(self, command_key: str, line_count: int, m400_was_sent: bool) -> bool:
+        """Waits until the line_count lines just sent for command_key have completed."""
+
+    # --- Line matchers ---
+    def register_line_matcher(self, pattern, callback):
+        """
+        Calls callback(match) from the reader thread for every received line that pattern.search() matches,
+        so callers can block on an Event instead of scanning message_queue. Lines are still queued as usual.
+
+        Args:
+            pattern (re.Pattern): Compiled pattern searched in each received line.
+            callback (callable): Called with the re.Match; must be quick and must not block.
+
+        Returns:
+            object: Token for unregister_line_matcher().
+        """
+        entry = (pattern, callback)
+        with self._matchers_lock: self._line_matchers += (entry,)
+        return entry
+
+    def unregister_line_matcher(self, token):
+        """Removes a matcher added by register_line_matcher(); unknown tokens are ignored."""
+        with self._matchers_lock: self._line_matchers = tuple(entry for entry in self._line_matchers if entry is not token)
+
+    def _run_line_matchers(self, line: str):
+        """Calls every registered matcher's callback whose pattern is found in line."""
+        for pattern, callback in self._line_matchers:
+            match = pattern.search(line)
+            if match is None: continue
+            try: callback(match)
+            except Exception as e: print(f"  Warning: Line matcher callback failed: {e}") # Never kill the reader thread
+
+    # --- Received lines and the in-flight window ---
+    def _on_line(self, line: str):
+        """Called by the reader thread for every non-empty received line."""
+        # A late 'ok' for a line given up on is not queued, so no wait can take it for its own
+        if not (line.lower().startswith('ok') and self._ack_inflight()): self.message_queue.put(line)
+        if self._line_matchers: self._run_line_matchers(line)
+
+    def _on_lines(self, lines: list):
+        """Like _on_line for every line of a burst (one WebSocket frame), queued with a single wake-up."""
+        if not lines: return
+        queued = [line for line in lines if not (line.lower().startswith('ok') and self._ack_inflight())]
+        if queued: self.message_queue.put_many(queued)
+        if self._line_matchers:
+            for line in lines: self._run_line_matchers(line)
+
+    def _clear_queue(self):
+        """Clears any pending messages from the queue."""
+        self.message_queue.clear()
+
+    def _reset_inflight(self):
+        """Forgets every outstanding line (on disconnect) and wakes anyone waiting on the window."""
+        with self._inflight_cv: self._inflight = 0; self._owed_oks = 0; self._inflight_cv.notify_all()
+
+    def _ack_inflight(self) -> bool:
+        """
+        Accounts for one received 'ok': frees an in-flight slot, or settles one owed by a timed-out window.
+
+        Returns:
+            bool: True if the 'ok' was owed (stale) and must not reach message_queue.
+        """
+        with self._inflight_cv:
+            # Marlin acknowledges in order, so the first 'ok's after a timeout belong to the abandoned lines
+            if self._owed_oks > 0: self._owed_oks -= 1; return True
+            if self._inflight > 0:
+                self._inflight -= 1
+                self._inflight_cv.notify_all()
+            return False
+
+    def _abandon_inflight(self):
+        """Gives up on the outstanding lines after a timeout (call with _inflight_cv held); their 'ok's become owed."""
+        print(f"  Warning: {self._inflight} in-flight line(s) never acknowledged; their late 'ok's will be discarded.")
+        self._owed_oks += self._inflight
+        self._inflight = 0
+
+    def _reserve_inflight(self, count: int = 1):
+        """Blocks until count more unacknowledged lines fit in the window, then reserves them."""
+        limit = max(self.inflight_limit, count)
+        with self._inflight_cv:
+            if not self._inflight_cv.wait_for(lambda: self._inflight + count <= limit or not self.is_connected, timeout=self.DEFAULT_INFLIGHT_TIMEOUT):
+                self._abandon_inflight()
+            self._inflight += count
+
+    def _release_inflight(self, count: int = 1):
+        """Returns slots reserved for lines that could not be written."""
+        with self._inflight_cv:
+            self._inflight = max(0, self._inflight - count)
+            self._inflight_cv.notify_all()
+
+    def drain(self) -> bool:
+        """
+        Blocks until every streamed line has been acknowledged, so the next 'ok' belongs to the next command.
+
+        Returns:
+            bool: True if the window emptied, False if 'ok's were still missing after DEFAULT_INFLIGHT_TIMEOUT.
+        """
+        with self._inflight_cv:
+            drained = self._inflight_cv.wait_for(lambda: self._inflight == 0 or not self.is_connected, timeout=self.DEFAULT_INFLIGHT_TIMEOUT)
+            if not drained: self._abandon_inflight()
+            self._inflight = 0 # Also forgets lines lost to a disconnect
+            return drained
+
+    def _next_message(self, deadline: float):
+        """Blocks for the next received line; returns None at the deadline or once the reader thread has stopped."""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not self.is_connected: return None
+        try: message = self.message_queue.get(timeout=remaining)
+        except queue.Empty: return None
+        return None if message is _CLOSED else message
+
+    # --- Sending ---
+    def _format_command(self, command_key: str, spec, kwargs: dict) -> str | None:
+        """Builds the G-code line for command_key with the formatter precompiled in commands.py. Returns None on error."""
+        if spec.format is None: print("Error: Command definition missing."); return None
+        try: return spec.format(kwargs) # send_command's kwargs dict is passed through, not re-expanded
+        except KeyError as e: print(f"Error: Missing parameter {e} for command '{command_key}'."); return None
+        except Exception as e: print(f"Error formatting G-code: {e}"); return None
+
+    def _send_fast(self, command_key, spec):
+        """Fire-and-forget path for parameter-free, non-waiting commands: one window slot and one write."""
+        self._reserve_inflight()
+        self._clear_queue() # Like every send, so message_queue readers (e.g. Hotplate.set_and_report) only see replies from here on
+        if self._send(spec.format(), spec.encoded): return True
+        self._release_inflight()
+        print(f"Error sending command '{command_key}'."); return False
+
+    def _send_lines(self, lines, should_wait, encoded=None) -> bool:
+        """Takes window slots (or drains the window before a wait), clears the queue and writes lines at once."""
+        # Waiting sends need every streamed line acknowledged first; others take one slot per line
+        if should_wait: self.drain()
+        else: self._reserve_inflight(len(lines))
+
+        self._clear_queue() # Clear queue before sending
+
+        if self._send("\n".join(lines), encoded): return True
+        if not should_wait: self._release_inflight(len(lines))
+        return False
+
+    def send_raw_gcode(self, gcode_string: str, encoded: bytes | None = None) -> bool:
+        """
+        Sends a raw G-code string directly without waiting.
+        encoded, if given, must be the stripped string's wire bytes (newline-terminated); transports that can use it skip encoding.
+        """
+        with self._send_lock:
+            if not gcode_string or not isinstance(gcode_string, str): print("Error: Invalid G-code string provided."); return False
+            gcode_string = gcode_string.strip()
+            line_count = gcode_string.count('\n') + 1
+            self._reserve_inflight(line_count)
+            if self._send(gcode_string, encoded): return True
+            self._release_inflight(line_count); return False
+
+    def send_command(self, command_key, **kwargs):
+        """
+        Looks up command, sends it (with M400 appended in the same write when configured)
+        and, if wait_after is True, waits for it with the transport's wait logic.
+        """
+        with self._send_lock:
+            if not self.is_connected:
+                if not self.connect(): print("Error: Cannot send command, connection failed."); return False
+            fast_spec = self._fast.get(command_key)
+            if fast_spec is not None and not kwargs: return self._send_fast(command_key, fast_spec)
+
+            spec = self._specs.get(command_key)
+            if spec is None: print(f"Error: Command key '{command_key}' not found."); return False
+            should_wait = spec.wait_after
+
+            print(f"\n[{_now_hms()}] Executing command '{command_key}': {spec.desc}")
+
+            final_gcode = self._format_command(command_key, spec, kwargs)
+            if final_gcode is None: return False
+
+            if spec.is_movement: print("*** SAFETY WARNING: Command causes movement! Ensure path clear. ***")
+
+            # M400 rides in the same write as the command, so both lines cost one transfer
+            lines = [final_gcode]
+            m400_was_sent = False
+            if should_wait and spec.send_m400:
+                if self._m400_gcode is None: print("Error: 'wait_finish' (M400) not defined."); return False
+                lines.append(self._m400_gcode); m400_was_sent = True
+                print(f"  Command requires M400. Sending it together with '{command_key}'.")
+            elif should_wait: print(f"  Command requires waiting, but M400 send is skipped for '{command_key}'.")
+
+            encoded = spec.encoded if len(lines) == 1 else None # Cached bytes only cover the bare command
+            if not self._send_lines(lines, should_wait, encoded):
+                print(f"Error sending primary command '{command_key}'."); return False
+
+            wait_success = True
+            if should_wait:
+                wait_success = self._wait_for_command(command_key, len(lines), m400_was_sent)
+                if not wait_success: print(f"Warning: Wait condition failed for command '{command_key}'.")
+            else: print(f"  Command does not require waiting. Proceeding immediately.")
+
+            print(f"[{_now_hms()}] Finished command '{command_key}'. Success: {wait_success}")
+            return wait_success
+
+    def send_command_async(self, command_key, **kwargs) -> concurrent.futures.Future:
+        """
+        Queues send_command(command_key, **kwargs) on a background worker so the caller doesn't block.
+
+        Async commands run one at a time in submission order, and every send holds _send_lock, so they
+        also never overlap a synchronous send_command / send_batch / send_raw_gcode from another thread
+        (they share one connection and one reply queue, so two at once would mix up their 'ok's).
+
+        Returns:
+            Future: Resolves to send_command's result (bool).
+        """
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='gcode')
+        return self._executor.submit(self.send_command, command_key, **kwargs)
+
+    def _shutdown_executor(self):
+        """Cancels queued async commands (the one already running finishes); called from disconnect()."""
+        if self._executor is None: return
+        self._executor.shutdown(wait=False, cancel_futures=True); self._executor = None
+
+    def send_batch(self, steps) -> bool:
+        """
+        Sends several commands in a single write and waits once for the whole batch.
+
+        Args:
+            steps (list[tuple[str, dict]]): (command_key, kwargs) pairs, sent in order.
+                The last step's wait_after / send_m400_before_wait settings apply to the batch.
+
+        Returns:
+            bool: True if the batch was written and the last step's wait condition was met.
+        """
+        with self._send_lock:
+            if not steps: return True
+            if not self.is_connected:
+                if not self.connect(): print("Error: Cannot send batch, connection failed."); return False
+
+            lines = []; is_movement = False
+            for command_key, kwargs in steps:
+                spec = self._specs.get(command_key)
+                if spec is None: print(f"Error: Command key '{command_key}' not found."); return False
+                gcode = self._format_command(command_key, spec, kwargs)
+                if gcode is None: return False
+                lines.append(gcode); is_movement = is_movement or spec.is_movement
+
+            last_key = steps[-1][0]
+            should_wait = spec.wait_after # spec of the last step
+            m400_was_sent = should_wait and spec.send_m400
+            if m400_was_sent:
+                if self._m400_gcode is None: print("Error: 'wait_finish' (M400) not defined."); return False
+                lines.append(self._m400_gcode)
+
+            print(f"\n[{_now_hms()}] Executing batch: {', '.join(key for key, _ in steps)}")
+            if is_movement: print("*** SAFETY WARNING: Command causes movement! Ensure path clear. ***")
+
+            if not self._send_lines(lines, should_wait): print("Error sending batch."); return False
+
+            wait_success = True
+            if should_wait:
+                wait_success = self._wait_for_command(last_key, len(lines), m400_was_sent)
+                if not wait_success: print(f"Warning: Wait condition failed for batch ending with '{last_key}'.")
+            else: print(f"  Batch does not require waiting. Proceeding immediately.")
+
+            print(f"[{_now_hms()}] Finished batch. Success: {wait_success}")
+            return wait_success
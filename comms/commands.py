@@ -1,6 +1,10 @@
 """
 Dictionary of commands called with human readable names and their associated GCode command
 """
+import sys
+import types
+from collections import namedtuple
+
 COMMANDS = {
     # Movement & Setup
     "home_all": {
@@ -75,4 +79,67 @@ COMMANDS = {
         "wait_after": True, "send_m400_before_wait": False
     },
     # Add any other commands here
-}
\ No newline at end of file
+}
+
+# --- Precompiled formatters ---
+# The table is static, so each entry's G-code builder is specialized once at import
+# and handlers just call COMMANDS[key]["format"](kwargs) with the parameter mapping.
+FORMAT_CACHE_SIZE = 256 # Max memoized lines per parameterized command
+_NO_PARAMS = types.MappingProxyType({})
+
+def _make_formatter(cmd_info):
+    """Returns a callable building the G-code line for cmd_info, or None if it has no G-code."""
+    if "gcode" in cmd_info:
+        template = cmd_info["gcode"]
+        if "{" not in template:
+            return lambda kwargs=_NO_PARAMS: template # Parameter-free, kwargs are ignored
+        return template.format_map # Consumes the mapping as-is; raises KeyError on a missing parameter
+    if "gcode_base" in cmd_info:
+        base = cmd_info["gcode_base"]
+        params = tuple(cmd_info.get("params", ()))
+        all_params = frozenset(params)
+        full_template = base + "".join(f" {param}{{{param}}}" for param in params) # e.g. "G1 E{E} F{F}"
+        cache = {} # Pre-formatted (all-str) kwargs -> line; protocol loops repeat the same pump steps
+        def format_gcode(kwargs=_NO_PARAMS):
+            # Only str values are cached: numbers that compare equal can still format differently (1 / 1.0 / True)
+            key = tuple(kwargs.items()) if all(type(value) is str for value in kwargs.values()) else None
+            if key is not None and (line := cache.get(key)) is not None: return line
+            # Usual case (every parameter given): one C-level format_map, no per-parameter loop
+            if all_params <= kwargs.keys(): line = full_template.format_map(kwargs)
+            else: line = base + "".join(f" {param}{kwargs[param]}" for param in params if param in kwargs)
+            if key is not None:
+                if len(cache) >= FORMAT_CACHE_SIZE: cache.clear()
+                cache[key] = line
+            return line
+        return format_gcode
+    return None
+
+for _cmd_info in COMMANDS.values():
+    _cmd_info["params"] = tuple(sys.intern(param) for param in _cmd_info.get("params", ()))
+    _cmd_info["format"] = _make_formatter(_cmd_info)
+
+# Read-only view with interned keys: safe to share between handler threads without copying
+COMMANDS = types.MappingProxyType({sys.intern(key): cmd_info for key, cmd_info in COMMANDS.items()})
+
+
+# --- Per-command dispatch specs ---
+# Flattened view of one COMMANDS entry, built once per handler so the send path
+# uses attribute access instead of repeated dict lookups and string checks.
+CmdSpec = namedtuple('CmdSpec', 'format desc wait_after send_m400 is_movement encoded')
+_MOVEMENT_PREFIXES = ("G0", "G1", "G28")
+
+def build_specs(commands_dict):
+    """Returns {command_key: CmdSpec} for every entry in commands_dict."""
+    specs = {}
+    for key, cmd_info in commands_dict.items():
+        template = cmd_info.get("gcode") or cmd_info.get("gcode_base") or ""
+        specs[key] = CmdSpec(
+            format=cmd_info.get("format") or _make_formatter(cmd_info),
+            desc=cmd_info.get("desc", "N/A"),
+            wait_after=bool(cmd_info.get("wait_after", False)),
+            send_m400=bool(cmd_info.get("send_m400_before_wait", False)),
+            is_movement=template.strip().upper().startswith(_MOVEMENT_PREFIXES),
+            # Wire bytes for parameter-free commands (G28, M83, M400...), so serial sends skip encode()
+            encoded=(cmd_info["gcode"] + "\n").encode("utf-8") if "{" not in cmd_info.get("gcode", "{") else None,
+        )
+    return specs
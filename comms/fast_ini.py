@@ -0,0 +1,96 @@
+"""
+Minimal regex-based reader for config.ini (drop-in for the parts of
+configparser.ConfigParser used by Main.py).
+
+Supported:
+    - [Section] headers (section names are case-sensitive)
+    - key = value pairs (keys are lower-cased, like configparser)
+    - full-line and inline comments starting with ';' or '#'
+    - get/getint/getfloat/getboolean with an optional fallback
+
+Not supported:
+    - multi-line value continuations
+    - value interpolation (%(name)s / ${section:name})
+    - the DEFAULT section and 'key:value' separators
+
+Use load() to get a parser cached by the file's mtime, so repeat loads of an
+unchanged file cost one os.stat().
+"""
+import os
+import re
+
+SECTION_RE = re.compile(r'^\[([^\]]+)\]')
+KV_RE = re.compile(r'^\s*([^=;#\s][^=]*?)\s*=\s*([^;#\n]*)')
+
+_BOOLEAN_STATES = {'1': True, 'yes': True, 'true': True, 'on': True,
+                   '0': False, 'no': False, 'false': False, 'off': False}
+_MISSING = object()
+_CACHE: dict[str, tuple[int, 'FastConfigParser']] = {} # path -> (st_mtime_ns, parser)
+
+
+class FastConfigParser:
+    """Parses a flat INI file into {section: {key: value}} in a single pass."""
+
+    def __init__(self):
+        self.sections = {}
+
+    def read(self, filepath: str) -> list:
+        """Parses the file; returns [filepath] if it was read, [] if it does not exist."""
+        try:
+            with open(filepath, 'r') as f:
+                text = f.read()
+        except FileNotFoundError:
+            return []
+        self.read_string(text)
+        return [filepath]
+
+    def read_string(self, text: str):
+        """Parses INI text, merging it into the already loaded sections."""
+        section = None
+        for line in text.splitlines():
+            match = SECTION_RE.match(line)
+            if match:
+                section = self.sections.setdefault(match.group(1).strip(), {})
+                continue
+            if section is None: continue # Keys before the first header are ignored
+            match = KV_RE.match(line)
+            if match: section[match.group(1).lower()] = match.group(2).strip()
+
+    def has_section(self, section: str) -> bool:
+        return section in self.sections
+
+    def get(self, section: str, key: str, fallback=_MISSING):
+        """Returns the raw string value, the fallback, or raises KeyError if neither exists."""
+        try:
+            return self.sections[section][key.lower()]
+        except KeyError:
+            if fallback is _MISSING:
+                raise KeyError(f"No option '{key}' in section '{section}'") from None
+            return fallback
+
+    def getint(self, section: str, key: str, fallback=_MISSING):
+        value = self.get(section, key, fallback)
+        return int(value) if isinstance(value, str) else value
+
+    def getfloat(self, section: str, key: str, fallback=_MISSING):
+        value = self.get(section, key, fallback)
+        return float(value) if isinstance(value, str) else value
+
+    def getboolean(self, section: str, key: str, fallback=_MISSING):
+        value = self.get(section, key, fallback)
+        if not isinstance(value, str): return value
+        if value.lower() not in _BOOLEAN_STATES:
+            raise ValueError(f"Not a boolean: {value}")
+        return _BOOLEAN_STATES[value.lower()]
+
+
+def load(filepath: str) -> FastConfigParser:
+    """Returns the parsed file, re-parsing only when its mtime has changed. Raises OSError if missing."""
+    mtime = os.stat(filepath).st_mtime_ns
+    hit = _CACHE.get(filepath)
+    if hit and hit[0] == mtime:
+        return hit[1]
+    parser = FastConfigParser()
+    parser.read(filepath)
+    _CACHE[filepath] = (mtime, parser)
+    return parser
@@ -0,0 +1,57 @@
+"""
+Bounded buffer for lines received from the G-code interpreter.
+
+Drop-in for the parts of queue.Queue the handlers and Robot use
+(put/get/get_nowait/empty), backed by a deque(maxlen) and a single
+Condition. put() never blocks: once full, the oldest line is discarded,
+which caps memory if nobody is reading (e.g. echo:busy spam while idle).
+"""
+import threading
+from collections import deque
+from queue import Empty
+
+DEFAULT_MAXLEN = 4096
+
+
+class MessageBuffer:
+    """FIFO of received lines; get() raises queue.Empty on timeout, like queue.Queue."""
+
+    def __init__(self, maxlen: int = DEFAULT_MAXLEN):
+        self._lines = deque(maxlen=maxlen)
+        self._ready = threading.Condition(threading.Lock())
+
+    def put(self, item):
+        """Appends a line and wakes one waiting reader (drops the oldest line when full)."""
+        with self._ready:
+            self._lines.append(item)
+            self._ready.notify()
+
+    def put_many(self, items):
+        """Appends several lines under one lock acquire and wakes the reader once."""
+        with self._ready:
+            self._lines.extend(items)
+            self._ready.notify()
+
+    def get(self, block: bool = True, timeout: float | None = None):
+        """Pops the oldest line, waiting up to timeout seconds (forever if None) when blocking."""
+        with self._ready:
+            if not self._ready.wait_for(lambda: self._lines, timeout if block else 0):
+                raise Empty
+            return self._lines.popleft()
+
+    def get_nowait(self):
+        try: return self._lines.popleft()
+        except IndexError: raise Empty from None
+
+    def empty(self) -> bool:
+        return not self._lines
+
+    def qsize(self) -> int:
+        return len(self._lines)
+
+    def clear(self) -> int:
+        """Discards every buffered line; returns how many were dropped."""
+        with self._ready:
+            count = len(self._lines)
+            self._lines.clear()
+            return count
@@ -0,0 +1,36 @@
+"""
+Optional RAM-disk mirror for the small files read at startup (config.ini,
+locations.json).
+
+Set MINIMALEE_RAMDISK to a tmpfs directory (e.g. /dev/shm) to enable it.
+Files are copied to <RAMDISK>/minimalee_cache/ and re-copied whenever the
+original's mtime or size changes; writes always go to the original path.
+When the variable is unset, or the mirror cannot be used, cached_path()
+returns the original path unchanged.
+"""
+import os
+import shutil
+
+RAMDISK = os.environ.get('MINIMALEE_RAMDISK', '')
+CACHE_DIR = os.path.join(RAMDISK, 'minimalee_cache') if RAMDISK else ''
+
+
+def cached_path(path: str) -> str:
+    """Returns the path to read `path` from: its fresh RAM-disk mirror, or `path` itself."""
+    if not CACHE_DIR: return path
+    try:
+        src = os.stat(path)
+        # Flatten the absolute path so files from different checkouts don't collide
+        mirror = os.path.join(CACHE_DIR, os.path.abspath(path).strip(os.sep).replace(os.sep, '_'))
+        try:
+            dst = os.stat(mirror)
+            if dst.st_mtime_ns == src.st_mtime_ns and dst.st_size == src.st_size: return mirror
+        except FileNotFoundError:
+            pass
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        temp_mirror = f"{mirror}.{os.getpid()}.tmp"
+        shutil.copy2(path, temp_mirror) # copy2 keeps the mtime used for the staleness check
+        os.replace(temp_mirror, mirror)
+        return mirror
+    except OSError:
+        return path
@@ -2,11 +2,16 @@
 import serial
 import time
 import sys
+import logging
 import threading
-import queue
+import re
 from .commands import COMMANDS
+from .base_handler import BaseGcodeHandler, _CLOSED, _now_hms
 
-class SerialHandler:
+# Per-line traffic is logged at DEBUG (Main.py -vv) so long jobs don't pay for a print per line
+log = logging.getLogger(__name__)
+
+class SerialHandler(BaseGcodeHandler):
     """
     Manages communication with a G-code interpreter (e.g., Marlin)
     over a direct USB Serial connection using pyserial.
@@ -14,30 +19,32 @@ class SerialHandler:
     """
     
     DEFAULT_WAIT_TIMEOUT = 120.0 # Default value in seconds
+    BOOT_TIMEOUT = 2.0 # Max seconds to wait for the board after opening the port (covers a DTR auto-reset)
+    BOOT_BANNER_RE = re.compile(rb'^(?:start|echo:\s*Marlin|grbl)', re.IGNORECASE)
 
     
-    def __init__(self, port: str, baudrate: int, commands_dict: dict,read_timeout: float = 1.0):
+    def __init__(self, port: str, baudrate: int, commands_dict: dict,read_timeout: float = 1.0, inflight_limit: int = 4):
         """
         Initializes the SerialHandler.
 
         Args:
             port (str): The serial port name (e.g., 'COM3' on Windows, '/dev/ttyACM0' on Linux).
             baudrate (int): The serial baud rate (must match firmware config, e.g., 115200, 250000).
-            commands_dict (dict): Dictionary defining G-code commands and wait behavior.
+            commands_dict (Mapping): Mapping defining G-code commands and wait behavior (read-only, e.g. COMMANDS).
             read_timeout (float): Timeout in seconds for reading each line from serial. Defaults to 1.0.
+            inflight_limit (int): Max lines sent without waiting that may still be awaiting their 'ok'
+                                  (should not exceed the firmware command buffer, Marlin BUFSIZE). Defaults to 4.
             connect_timeout (float): Timeout in seconds for establishing initial connection (currently informational).
         """
       
 
+        super().__init__(commands_dict, inflight_limit)
         self.port = port
         self.baudrate = baudrate
-        self.commands = commands_dict
         self.read_timeout = read_timeout
         self.wait_timeout = self.DEFAULT_WAIT_TIMEOUT
 
         self.serial_connection = None # Holds the pyserial Serial object
-        self.is_connected = False
-        self.message_queue = queue.Queue() # Queue for received lines
         self.reader_thread = None # Thread for reading serial
         self.reader_stop_event = threading.Event()
 
@@ -51,8 +58,8 @@ class SerialHandler:
             self.serial_connection.port = self.port
             self.serial_connection.baudrate = self.baudrate
             self.serial_connection.open()
-            time.sleep(2.0)
-            self.serial_connection.reset_input_buffer()
+            if not self._wait_for_boot(): print(f"  No boot banner or 'ok' within {self.BOOT_TIMEOUT}s; continuing.")
+            self.serial_connection.reset_input_buffer() # Drop the banner / probe reply
             self._clear_queue()
             self.is_connected = True
             self.reader_stop_event.clear()
@@ -68,6 +75,23 @@ class SerialHandler:
             if self.serial_connection and self.serial_connection.is_open: self.serial_connection.close()
             self.serial_connection = None; self.is_connected = False; return False
 
+    def _wait_for_boot(self) -> bool:
+        """
+        Returns as soon as the firmware is listening: either its boot banner arrives (board
+        auto-reset on open) or it acknowledges a probe (no reset). False after BOOT_TIMEOUT.
+        """
+        conn = self.serial_connection
+        read_timeout = conn.timeout; conn.timeout = 0.1 # Short reads so the deadline is honoured
+        deadline = time.monotonic() + self.BOOT_TIMEOUT
+        try:
+            conn.write(b"M110 N0\n"); conn.flush() # Harmless probe; lost in the bootloader if the board is resetting
+            while time.monotonic() < deadline:
+                line = conn.readline().strip()
+                if line.lower().startswith(b"ok") or self.BOOT_BANNER_RE.match(line): return True
+            return False
+        finally:
+            conn.timeout = read_timeout
+
     def _serial_reader_thread(self):
         """Runs in background, reads lines from serial, puts them in queue."""
         print("Serial reader thread started.")
@@ -77,7 +101,7 @@ class SerialHandler:
                 if line_bytes:
                     try:
                         line_str = line_bytes.decode('utf-8').strip()
-                        if line_str: self.message_queue.put(line_str)
+                        if line_str: self._on_line(line_str)
                     except UnicodeDecodeError: print(f"  [Serial Recv] Warning: Could not decode line: {line_bytes!r}")
             except serial.SerialException as e:
                  if not self.reader_stop_event.is_set(): print(f"Serial reader error: {e}")
@@ -85,6 +109,7 @@ class SerialHandler:
             except Exception as e:
                  if not self.reader_stop_event.is_set(): print(f"Unexpected serial reader error: {e}")
                  self.is_connected = False; break
+        self.message_queue.put(_CLOSED)
         print("Serial reader thread stopped.")
 
     def disconnect(self):
@@ -96,113 +121,51 @@ class SerialHandler:
             try: self.serial_connection.close()
             except Exception as e: print(f"Error closing serial port: {e}")
         self.is_connected = False; self.serial_connection = None; self.reader_thread = None
+        self._shutdown_executor()
+        self._reset_inflight()
         print("Serial disconnected.")
 
-    def _clear_queue(self):
-        """Clears any pending messages from the queue."""
-        while not self.message_queue.empty():
-            try: self.message_queue.get_nowait()
-            except queue.Empty: break
-
-    def _send_serial_command(self, gcode_command: str) -> bool:
-        """Sends a G-code string over the serial connection."""
+    def _send_serial_command(self, gcode_command: str, encoded: bytes | None = None) -> bool:
+        """Sends a G-code string over the serial connection (encoded: its precomputed wire bytes, if known)."""
         if not self.is_connected or not self.serial_connection or not self.serial_connection.is_open: print("Error: Serial not connected."); return False
         try:
-            command_with_newline = (gcode_command + '\n').encode('utf-8')
-            print(f"  [{time.strftime('%H:%M:%S')}] Sending Serial: '{gcode_command}'")
+            command_with_newline = encoded or (gcode_command + '\n').encode('utf-8')
+            print(f"  [{_now_hms()}] Sending Serial: '{gcode_command}'")
             self.serial_connection.write(command_with_newline)
             self.serial_connection.flush()
             return True
         except serial.SerialException as e: print(f"Serial write error: {e}"); self.is_connected = False; return False
         except Exception as e: print(f"Unexpected serial write error: {e}"); return False
 
-    def _wait_for_ok(self) -> bool:
+    def _wait_for_ok(self, ok_count: int = 1) -> bool:
         """
-        Waits for an 'ok' response from the serial message queue using self.wait_timeout.
-        Returns True if 'ok' received, False on timeout or error.
+        Waits for ok_count 'ok' responses (one per line sent) from the serial message queue using self.wait_timeout.
+        Returns True if all 'ok's received, False on timeout or error.
         """
         # Uses self.wait_timeout defined in __init__
-        print(f"  [{time.strftime('%H:%M:%S')}] Waiting for 'ok' response (max {self.wait_timeout}s)...")
-        start_wait_time = time.time()
-
-        while time.time() - start_wait_time < self.wait_timeout:
-            try:
-                message = self.message_queue.get(timeout=1.0)
-                print(f"    [Serial Wait] Received: '{message}'")
-                if message.lower() == 'ok':
-                    print(f"  [{time.strftime('%H:%M:%S')}] 'ok' received.")
-                    return True
-                if message.startswith("echo:busy"):
-                     print("    [Serial Wait] Received busy echo, continuing wait...")
-                     continue
-            except queue.Empty:
-                if not self.is_connected: print("  Error: Serial disconnected while waiting."); return False
-                if self.reader_thread is None or not self.reader_thread.is_alive(): print("  Error: Serial reader thread is not running."); return False
-                continue
-            except Exception as e: print(f"  Error while waiting for serial message: {e}"); return False
-
-        print(f"  [{time.strftime('%H:%M:%S')}] Error: Wait for 'ok' timed out after {self.wait_timeout} seconds.")
+        print(f"  [{_now_hms()}] Waiting for {ok_count} 'ok' response(s) (max {self.wait_timeout}s)...")
+        deadline = time.monotonic() + self.wait_timeout
+
+        # Sleeps until a line arrives instead of waking every second to re-check the clock
+        while (message := self._next_message(deadline)) is not None:
+            log.debug("[Serial Wait] Received: '%s'", message)
+            if message.lower() == 'ok':
+                ok_count -= 1
+                if ok_count > 0: continue
+                print(f"  [{_now_hms()}] 'ok' received.")
+                return True
+            if message.startswith("echo:busy"):
+                 log.debug("[Serial Wait] Received busy echo, continuing wait...")
+                 continue
+
+        if time.monotonic() < deadline: print("  Error: Serial disconnected while waiting."); return False
+        print(f"  [{_now_hms()}] Error: Wait for 'ok' timed out after {self.wait_timeout} seconds.")
         return False # Timeout
 
-    # --- Public Methods ---
-    def send_raw_gcode(self, gcode_string: str) -> bool:
-        """
-        Sends a raw G-code string directly over serial without waiting.
-        """
-        if not gcode_string or not isinstance(gcode_string, str): print("Error: Invalid G-code string provided."); return False
-        return self._send_serial_command(gcode_string.strip())
-
-    def send_command(self, command_key, **kwargs):
-        """
-        Looks up command, sends via Serial, conditionally sends M400,
-        waits for 'ok' response if wait_after is True.
-        """
-        if not self.is_connected:
-            if not self.connect(): print("Error: Cannot send command, connection failed."); return False
-        if command_key not in self.commands: print(f"Error: Command key '{command_key}' not found."); return False
-
-        cmd_info = self.commands[command_key]
-        final_gcode = ""
-        should_wait = cmd_info.get("wait_after", False)
-        should_send_m400 = cmd_info.get("send_m400_before_wait", False)
-
-        print(f"\n[{time.strftime('%H:%M:%S')}] Executing command '{command_key}': {cmd_info.get('desc', 'N/A')}")
-
-        # Format G-code
-        if "gcode" in cmd_info:
-            try: final_gcode = cmd_info["gcode"].format(**kwargs)
-            except KeyError as e: print(f"Error: Missing parameter {e} for command '{command_key}'."); return False
-            except Exception as e: print(f"Error formatting G-code: {e}"); return False
-        elif "gcode_base" in cmd_info:
-            final_gcode = cmd_info["gcode_base"]
-            for param in cmd_info.get("params", []):
-                if param in kwargs: final_gcode += f" {param}{kwargs[param]}"
-        else: print("Error: Command definition missing."); return False
-
-        if final_gcode.strip().upper().startswith(("G0", "G1", "G28")): print("*** SAFETY WARNING: Command causes movement! Ensure path clear. ***")
-
-        self._clear_queue() # Clear queue before sending
-
-        if not self._send_serial_command(final_gcode): print(f"Error sending primary command '{command_key}' via Serial."); return False
-
-        wait_success = True
-        if should_wait:
-            m400_was_sent = False
-            if should_send_m400:
-                print(f"  Command requires M400. Clearing queue before sending M400...")
-                self._clear_queue()
-                m400_cmd_info = self.commands.get("wait_finish")
-                if not m400_cmd_info or "gcode" not in m400_cmd_info: print("Error: 'wait_finish' (M400) not defined."); return False
-                m400_gcode = m400_cmd_info["gcode"]
-                if not self._send_serial_command(m400_gcode): print(f"  Error sending M400 after '{command_key}'."); return False
-                m400_was_sent = True
-            else: print(f"  Command requires waiting, but M400 send is skipped for '{command_key}'.")
-
-            # Wait for the final 'ok' response
-            wait_success = self._wait_for_ok() # Calls the internal wait function
-            if not wait_success: print(f"Warning: Wait for 'ok' failed for command '{command_key}'.")
-        else: print(f"  Command does not require waiting. Proceeding immediately.")
-
-        print(f"[{time.strftime('%H:%M:%S')}] Finished command '{command_key}'. Success: {wait_success}")
-        return wait_success
+    def _send(self, gcode_command: str, encoded: bytes | None = None) -> bool:
+        """Transport hook for BaseGcodeHandler: writes to the serial port."""
+        return self._send_serial_command(gcode_command, encoded)
 
+    def _wait_for_command(self, command_key: str, line_count: int, m400_was_sent: bool) -> bool:
+        """Marlin acknowledges every line, so the command is done after line_count 'ok's (the last once M400 has finished the move)."""
+        return self._wait_for_ok(ok_count=line_count)
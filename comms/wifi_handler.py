@@ -1,11 +1,15 @@
 import requests
+from requests.adapters import HTTPAdapter
 import time
 import sys
+import socket
 import websocket # Requires pip install websocket-client
 import threading
-import queue
 import re
+import logging
+from urllib.parse import quote_plus
 from .commands import COMMANDS
+from .base_handler import BaseGcodeHandler, _CLOSED, _now_hms
 
 
 
@@ -23,33 +27,63 @@ WAIT_TIMEOUT = 120 # Max time to wait for command completion
 BASE_HTTP_URL = f"http://{ESP3D_IP}:{ESP3D_HTTP_PORT}"
 WS_URL = f"ws://{ESP3D_IP}:{ESP3D_WS_PORT}/"
 COMMAND_ENDPOINT = "/command"
+# Disable Nagle so one-line G-code frames leave immediately. urllib3 (HTTP) and
+# websocket-client already default to this; it is set explicitly so it can't regress.
+NODELAY_SOCKOPT = (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
+# Per-line traffic is logged at DEBUG (Main.py -vv) so long jobs don't pay for a print per line
+log = logging.getLogger(__name__)
 
-class WifiHandler: # Renamed class as per user's code
+
+class _NoDelayAdapter(HTTPAdapter):
+    """HTTPAdapter whose pooled connections always set TCP_NODELAY."""
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs.setdefault("socket_options", [NODELAY_SOCKOPT])
+        super().init_poolmanager(*args, **kwargs)
+
+
+class WifiHandler(BaseGcodeHandler): # Renamed class as per user's code
     """
     Manages communication with an ESP3D device over WiFi
     using HTTP for sending commands and WebSocket for receiving responses.
     Uses command-specific wait logic defined in the passed commands_dict.
     """
-    def __init__(self, http_url, ws_url, commands_dict):
+    # ESP3D/Marlin chatter that never completes a wait; dropped by the receiver before it is queued
+    _NOISE_RE = re.compile(r'^(?:PING:|echo:busy|ACTIVE_ID:)')
+    # Case-insensitive 'ok'; fullmatch on the line (or its last two characters) avoids lowercasing whole lines
+    _OK_RE = re.compile(r'ok', re.IGNORECASE)
+    # Position reports (M114): "X:10.00 Y:20.00 Z:5.00 E:0.00 ..."; no backtracking on odd lines
+    position_pattern = re.compile(r'^X:\S*\s+Y:\S*\s+Z:', re.IGNORECASE)
+
+    def __init__(self, http_url, ws_url, commands_dict, ws_send=False, inflight_limit=4):
         """
         Initializes the WifiHandler (ESP3D specific).
 
         Args:
             http_url (str): The base URL for HTTP commands (e.g., "http://192.168.0.1:80").
             ws_url (str): The URL for the WebSocket connection (e.g., "ws://192.168.0.1:81/").
-            commands_dict (dict): The dictionary defining known G-code commands and wait behavior.
+            commands_dict (Mapping): The mapping defining known G-code commands and wait behavior (read-only, e.g. COMMANDS).
+            ws_send (bool): Send G-code over the open WebSocket instead of one HTTP GET per command
+                            (falls back to HTTP if the WebSocket send fails).
+            inflight_limit (int): Max commands sent without waiting that may still be awaiting their 'ok'
+                                  (should not exceed the firmware command buffer). Defaults to 4.
         """
+        super().__init__(commands_dict, inflight_limit) # Stores the passed-in commands dictionary
         self.http_url = http_url
+        self._cmd_url = http_url + COMMAND_ENDPOINT # Built once instead of per send
+        self._cmd_prefix = self._cmd_url + "?commandText=" # Query encoded by hand; same bytes as requests' params=
+        # Wait function per waiting command, resolved once instead of an if/elif chain per send
+        self._wait_fns = {key: self._select_wait(key, spec.send_m400) for key, spec in self._specs.items() if spec.wait_after}
         self.ws_url = ws_url if ws_url.startswith("ws://") else f"ws://{ws_url}"
-        self.commands = commands_dict # Store the passed-in commands dictionary
         self.ws = None
         self.ws_thread = None
         self.ws_stop_event = threading.Event()
-        self.message_queue = queue.Queue()
-        self.is_connected = False
-        # Pattern for position reports
-        self.position_pattern = re.compile(r"X:.*Y:.*Z:", re.IGNORECASE)
+        self.ws_send = ws_send
+        self._ws_send_lock = threading.Lock() # websocket-client sends are not thread-safe
+        # One keep-alive HTTP session for all sends, so the TCP handshake is paid once
+        self._session = requests.Session()
+        self._session.mount("http://", _NoDelayAdapter(pool_connections=1, pool_maxsize=4, max_retries=0))
+        self._session.headers.update({"Connection": "keep-alive"})
 
     def connect(self):
         """Establishes the WebSocket connection and starts receiver thread."""
@@ -58,7 +92,7 @@ class WifiHandler: # Renamed class as per user's code
             # Log updated to reflect specific handler type
             print(f"Connecting to ESP3D WebSocket at {self.ws_url} using 'arduino' subprotocol...")
             self.ws = websocket.create_connection(
-                self.ws_url, timeout=10, subprotocols=["arduino"]
+                self.ws_url, timeout=10, subprotocols=["arduino"], sockopt=(NODELAY_SOCKOPT,)
             )
             self.is_connected = True
             self.ws_stop_event.clear()
@@ -78,17 +112,13 @@ class WifiHandler: # Renamed class as per user's code
             try:
                 message = self.ws.recv()
                 if message:
-                    decoded_message = ""
                     try:
-                        if isinstance(message, bytes): decoded_message = message.decode('utf-8').strip()
-                        else: decoded_message = message.strip()
-                        # Handle potential multi-line messages by splitting
-                        if decoded_message:
-                             lines = decoded_message.replace('\r\n', '\n').split('\n')
-                             for line in lines:
-                                 if line.strip(): # Add non-empty lines to queue
-                                     self.message_queue.put(line.strip())
-                    except UnicodeDecodeError: print(f"  [WS Recv] Warning: Could not decode message as UTF-8: {message}")
+                        # Binary frames are decoded leniently so one bad byte doesn't drop the 'ok's around it
+                        if isinstance(message, bytes): message = message.decode('utf-8', 'replace')
+                        # Handle multi-line messages (\n, \r\n or \r) in one C-level split; the
+                        # frame's non-empty, non-noise lines are queued together, waking the waiter once per frame
+                        noise = self._NOISE_RE.match
+                        self._on_lines([line for line in map(str.strip, message.splitlines()) if line and not noise(line)])
                     except Exception as e: print(f"  [WS Recv] Error processing message: {e}")
             except websocket.WebSocketConnectionClosedException:
                 if not self.ws_stop_event.is_set(): print("WebSocket connection closed unexpectedly.")
@@ -97,6 +127,7 @@ class WifiHandler: # Renamed class as per user's code
             except Exception as e:
                 if not self.ws_stop_event.is_set(): print(f"WebSocket receive error: {e}")
                 self.is_connected = False; break
+        self.message_queue.put(_CLOSED)
         print("WebSocket receiver thread stopped.")
 
     def disconnect(self):
@@ -107,171 +138,102 @@ class WifiHandler: # Renamed class as per user's code
             print("Closing WebSocket connection...")
             try: self.ws.close(timeout=3)
             except Exception as e: print(f"Error closing WebSocket: {e}")
+        self._session.close() # Drops pooled HTTP connections; the session reconnects on next use
         self.is_connected = False; self.ws = None; self.ws_thread = None
+        self._shutdown_executor()
+        self._reset_inflight()
         print("Disconnected.")
 
-    def _clear_queue(self):
-        """Clears any pending messages from the queue."""
-        count = 0
-        while not self.message_queue.empty():
-            try: self.message_queue.get_nowait(); count += 1
-            except queue.Empty: break
-        # if count > 0: print(f"  Cleared {count} potentially stale messages from queue.")
-
     def _send_http_command(self, gcode_command):
-        """Sends a G-code command via HTTP GET (ESP3D specific implementation)."""
-        # Use self.http_url stored during initialization
-        full_url = self.http_url + COMMAND_ENDPOINT
-        params = {'commandText': gcode_command}
-        print(f"  [{time.strftime('%H:%M:%S')}] Sending HTTP GET: '{gcode_command}'")
-        start_time = time.time()
+        """Sends a G-code command via HTTP GET on the keep-alive session (ESP3D specific implementation)."""
+        print(f"  [{_now_hms()}] Sending HTTP GET: '{gcode_command}'")
+        start_time = time.monotonic()
         try:
             # Use HTTP_TIMEOUT constant defined globally (or pass as arg)
-            response = requests.get(full_url, params=params, timeout=HTTP_TIMEOUT)
-            end_time = time.time()
-            print(f"  [{time.strftime('%H:%M:%S')}] HTTP request completed in {end_time - start_time:.2f}s (Status: {response.status_code})")
+            response = self._session.get(self._cmd_prefix + quote_plus(gcode_command), timeout=HTTP_TIMEOUT)
+            end_time = time.monotonic()
+            print(f"  [{_now_hms()}] HTTP request completed in {end_time - start_time:.2f}s (Status: {response.status_code})")
             response.raise_for_status()
             return True
         except Exception as e:
             print(f"  Error during HTTP send: {e}")
             return False
 
+    def _send_ws_command(self, gcode_command):
+        """Sends a G-code command as a text frame on the already open WebSocket."""
+        print(f"  [{_now_hms()}] Sending WS: '{gcode_command}'")
+        try:
+            with self._ws_send_lock: self.ws.send(gcode_command + "\n")
+            return True
+        except Exception as e:
+            print(f"  Error during WS send: {e}")
+            return False
+
+    def _send(self, gcode_command, encoded=None):
+        """ Transport hook for BaseGcodeHandler: WebSocket when ws_send is enabled and open, otherwise (or on failure) HTTP. encoded is unused. """
+        if self.ws_send and self.is_connected and self.ws is not None:
+            if self._send_ws_command(gcode_command): return True
+            print("  Falling back to HTTP send.")
+        return self._send_http_command(gcode_command)
+
     # --- Specific Wait Functions ---
 
+    def _wait_failed(self, deadline, what):
+        """ Reports why a wait loop ended without a match (disconnect or timeout). Always returns False. """
+        if time.monotonic() < deadline: print("  Error: WebSocket disconnected or thread stopped while waiting."); return False
+        print(f"  [{_now_hms()}] Error: Wait for {what} timed out."); return False
+
+    # Each wait sleeps until a line arrives instead of waking every second to re-check the clock
+
     def _wait_for_position_report(self, wait_timeout):
         """ Waits for the position report message (X:Y:Z:) via WebSocket. """
-        print(f"  [{time.strftime('%H:%M:%S')}] Waiting for Position Report (max {wait_timeout}s)...")
-        start_wait_time = time.time()
-        while time.time() - start_wait_time < wait_timeout:
-            try:
-                message = self.message_queue.get(timeout=1.0)
-                print(f"    [WS Wait Pos] Received: '{message}'")
-                if self.position_pattern.match(message): # Check if message STARTS with X: Y: Z:
-                    print(f"  [{time.strftime('%H:%M:%S')}] Position Report received.")
-                    return True
-                if message.startswith("PING:") or message.startswith("echo:busy") or message.startswith("ACTIVE_ID:"):
-                    continue # Ignore known noise
-            except queue.Empty:
-                if not self.is_connected or (self.ws_thread and not self.ws_thread.is_alive()):
-                    print("  Error: WebSocket disconnected or thread stopped while waiting."); return False
-                continue
-            except Exception as e: print(f"  Error while waiting for WS message: {e}"); return False
-        print(f"  [{time.strftime('%H:%M:%S')}] Error: Wait for Position Report timed out."); return False
+        print(f"  [{_now_hms()}] Waiting for Position Report (max {wait_timeout}s)...")
+        deadline = time.monotonic() + wait_timeout
+        while (message := self._next_message(deadline)) is not None:
+            log.debug("[WS Wait Pos] Received: '%s'", message)
+            if self.position_pattern.match(message): # Check if message STARTS with X: Y: Z:
+                print(f"  [{_now_hms()}] Position Report received.")
+                return True
+        return self._wait_failed(deadline, "Position Report")
 
     def _wait_for_delayed_ok(self, wait_timeout):
         """ Waits for 'ok' suffix, ignoring premature ones using a time filter. (Used after M400) """
-        print(f"  [{time.strftime('%H:%M:%S')}] Waiting for DELAYED 'ok' suffix (max {wait_timeout}s)...")
-        start_wait_time = time.time()
-        ignore_premature_ok_window = 1.5
-
-        while time.time() - start_wait_time < wait_timeout:
-            try:
-                message = self.message_queue.get(timeout=1.0)
-                print(f"    [WS Wait DelayOK] Received: '{message}'")
-                is_ok = message.lower() == 'ok'
-                is_ok_suffix = not is_ok and message.lower().endswith('ok') # Check suffix only if not exactly 'ok'
-                if is_ok or is_ok_suffix:
-                    time_elapsed = time.time() - start_wait_time
-                    if time_elapsed < ignore_premature_ok_window: print(f"    [WS Wait DelayOK] Ignoring potentially premature 'ok' received after {time_elapsed:.2f}s."); continue
-                    else: print(f"  [{time.strftime('%H:%M:%S')}] Delayed 'ok' received after {time_elapsed:.2f}s."); return True
-                if message.startswith("PING:") or message.startswith("echo:busy") or message.startswith("ACTIVE_ID:"): continue
-            except queue.Empty:
-                 if not self.is_connected or (self.ws_thread and not self.ws_thread.is_alive()): print("  Error: WebSocket disconnected or thread stopped while waiting."); return False
-                 continue
-            except Exception as e: print(f"  Error while waiting for WS message: {e}"); return False
-        print(f"  [{time.strftime('%H:%M:%S')}] Error: Wait for delayed 'ok' suffix timed out."); return False
+        print(f"  [{_now_hms()}] Waiting for DELAYED 'ok' suffix (max {wait_timeout}s)...")
+        start_wait_time = time.monotonic()
+        deadline = start_wait_time + wait_timeout
+        ignore_until = start_wait_time + 1.5 # 'ok's before this are taken as premature
+
+        while (message := self._next_message(deadline)) is not None:
+            log.debug("[WS Wait DelayOK] Received: '%s'", message)
+            if self._OK_RE.fullmatch(message[-2:]): # Exactly 'ok' or an 'ok' suffix
+                now = time.monotonic()
+                if now < ignore_until: log.debug("[WS Wait DelayOK] Ignoring potentially premature 'ok'."); continue
+                print(f"  [{_now_hms()}] Delayed 'ok' received after {now - start_wait_time:.2f}s."); return True
+        return self._wait_failed(deadline, "delayed 'ok' suffix")
 
     def _wait_for_simple_ok(self, wait_timeout):
         """ Waits for the first message that IS 'ok' (case-insensitive). (Used after G4). """
-        print(f"  [{time.strftime('%H:%M:%S')}] Waiting for SIMPLE 'ok' (max {wait_timeout}s)...")
-        start_wait_time = time.time()
-        while time.time() - start_wait_time < wait_timeout:
-            try:
-                message = self.message_queue.get(timeout=1.0)
-                print(f"    [WS Wait SimpleOK] Received: '{message}'")
-                if message.lower() == 'ok': # Check if message IS 'ok'
-                    print(f"  [{time.strftime('%H:%M:%S')}] Simple 'ok' received.")
-                    return True
-                if message.startswith("PING:") or message.startswith("echo:busy") or message.startswith("ACTIVE_ID:"): continue
-            except queue.Empty:
-                 if not self.is_connected or (self.ws_thread and not self.ws_thread.is_alive()): print("  Error: WebSocket disconnected or thread stopped while waiting."); return False
-                 continue
-            except Exception as e: print(f"  Error while waiting for WS message: {e}"); return False
-        print(f"  [{time.strftime('%H:%M:%S')}] Error: Wait for simple 'ok' timed out."); return False
-
-    # Renamed method to be more generic, implementation still ESP3D specific
-    def send_command(self, command_key, **kwargs):
-        """
-        Looks up command, sends (currently via ESP3D HTTP), clears queue,
-        conditionally sends M400, calls the appropriate wait function
-        based on command type if wait_after is True.
-        """
-        if not self.is_connected:
-            if not self.connect(): print("Error: Cannot send command, connection failed."); return False
-        # Use self.commands (passed during init) to find command info
-        if command_key not in self.commands: print(f"Error: Command key '{command_key}' not found."); return False
-
-        cmd_info = self.commands[command_key]
-        final_gcode = ""
-        should_wait = cmd_info.get("wait_after", False)
-        should_send_m400 = cmd_info.get("send_m400_before_wait", False)
-
-        print(f"\n[{time.strftime('%H:%M:%S')}] Executing command '{command_key}': {cmd_info.get('desc', 'N/A')}")
-
-        # Format G-code using self.commands
-        if "gcode" in cmd_info:
-            try: final_gcode = cmd_info["gcode"].format(**kwargs)
-            except KeyError as e: print(f"Error: Missing parameter {e} for command '{command_key}'."); return False
-            except Exception as e: print(f"Error formatting G-code: {e}"); return False
-        elif "gcode_base" in cmd_info:
-            final_gcode = cmd_info["gcode_base"]
-            for param in cmd_info.get("params", []):
-                if param in kwargs: final_gcode += f" {param}{kwargs[param]}"
-        else: print("Error: Command definition missing."); return False
-
-        if final_gcode.strip().upper().startswith(("G0", "G1", "G28")):
-            print("*** SAFETY WARNING: Command causes movement! Ensure path clear. ***")
-
-        self._clear_queue() # Clear before sending
-
-        # Send the primary command (currently hardcoded to HTTP)
-        if not self._send_http_command(final_gcode):
-            print(f"Error sending primary command '{command_key}' via HTTP."); return False
-
-        wait_success = True
-        if should_wait:
-            m400_was_sent = False
-            if should_send_m400:
-                print(f"  Command requires M400. Clearing queue before sending M400...")
-                self._clear_queue()
-                # Use self.commands to get M400 info
-                m400_cmd_info = self.commands.get("wait_finish")
-                if not m400_cmd_info or "gcode" not in m400_cmd_info: print("Error: 'wait_finish' (M400) not defined."); return False
-                m400_gcode = m400_cmd_info["gcode"]
-                # Send M400 (currently hardcoded to HTTP)
-                if not self._send_http_command(m400_gcode): print(f"  Error sending M400 after '{command_key}'."); return False
-                m400_was_sent = True
-            else:
-                 print(f"  Command requires waiting, but M400 send is skipped for '{command_key}'.")
-
-            # --- Dispatch to correct wait logic ---
-            # Use WAIT_TIMEOUT constant defined globally (or pass as arg)
-            if command_key == "home_all":
-                wait_success = self._wait_for_position_report(WAIT_TIMEOUT)
-            elif m400_was_sent: # Assumes M400 was sent for moves like G1, pump_move
-                 wait_success = self._wait_for_delayed_ok(WAIT_TIMEOUT)
-            elif command_key == "dwell": # G4 command
-                 wait_success = self._wait_for_simple_ok(WAIT_TIMEOUT)
-            else: # Default wait for other commands marked wait_after=True
-                 print(f"  Using simple 'ok' wait for '{command_key}'")
-                 wait_success = self._wait_for_simple_ok(WAIT_TIMEOUT)
-
-            if not wait_success: print(f"Warning: Wait condition failed for command '{command_key}'.")
-        else:
-             print(f"  Command does not require waiting. Proceeding immediately.")
-
-        print(f"[{time.strftime('%H:%M:%S')}] Finished command '{command_key}'. Success: {wait_success}")
-        return wait_success
+        print(f"  [{_now_hms()}] Waiting for SIMPLE 'ok' (max {wait_timeout}s)...")
+        deadline = time.monotonic() + wait_timeout
+        while (message := self._next_message(deadline)) is not None:
+            log.debug("[WS Wait SimpleOK] Received: '%s'", message)
+            if self._OK_RE.fullmatch(message): # Check if message IS 'ok'
+                print(f"  [{_now_hms()}] Simple 'ok' received.")
+                return True
+        return self._wait_failed(deadline, "simple 'ok'")
+
+    @classmethod
+    def _select_wait(cls, command_key, m400_was_sent):
+        """ Returns the (unbound) wait function for command_key, given whether M400 is sent with it. """
+        if command_key == "home_all": return cls._wait_for_position_report
+        if m400_was_sent: return cls._wait_for_delayed_ok # Assumes M400 was sent for moves like G1, pump_move
+        return cls._wait_for_simple_ok # G4 dwell and any other command marked wait_after=True
+
+    def _wait_for_command(self, command_key, line_count, m400_was_sent):
+        """ Dispatches to the wait function matching command_key (and whether M400 was sent). """
+        wait_fn = self._wait_fns.get(command_key) or self._select_wait(command_key, m400_was_sent)
+        # Use WAIT_TIMEOUT constant defined globally (or pass as arg)
+        return wait_fn(self, WAIT_TIMEOUT)
 
     # --- High-Level Methods REMOVED ---
     # Moved to device-specific classes (Pump, Sonicator)
@@ -1,11 +1,21 @@
 import time
 import math 
-from comms.wifi_handler import WifiHandler
-from comms.serial_handler import SerialHandler
+import re
+import logging
+import threading
+from comms.base_handler import CommsProtocol # Light: neither transport (pyserial/websocket) is imported
+
+# Timestamps come from the logging formatter configured in Main.py
+log = logging.getLogger(__name__)
 
 
 class Hotplate:
     """Control the hotplate using the 3d printer hotbed (Simplified, Handler Agnostic)."""
+    __slots__ = ('comms', 'max_temp', 'current_target')
+    # Bed reading in an M105 report, e.g. "ok T:21.3 /0.0 B:24.8 /60.0 @:0 B@:127"
+    bed_temp_pattern = re.compile(r'\bB:\s*(-?\d+(?:\.\d+)?)\s*/\s*(-?\d+(?:\.\d+)?)')
+    REPORT_TIMEOUT = 5.0 # Seconds to wait for the M105 reply in set_and_report
+    DISCONNECT_CHECK_INTERVAL = 0.5 # Seconds between connection checks while waiting for that reply
 
     
     def __init__(self, comms, max_temp: float = 150.0):
@@ -17,8 +27,8 @@ class Hotplate:
             max_temp (float): Maximum safe temperature in Celsius for safety checks.
         """
         # Runtime check for either handler type is still important
-        if not isinstance(comms, (WifiHandler, SerialHandler)):
-             raise TypeError("Communicator must be an instance of WifiHandler or SerialHandler")
+        if not isinstance(comms, CommsProtocol):
+             raise TypeError("Communicator must be a G-code handler (e.g. WifiHandler or SerialHandler)")
         if not isinstance(max_temp, (int, float)) or max_temp <= 0:
              raise ValueError("max_temp must be a positive number.")
 
@@ -26,7 +36,17 @@ class Hotplate:
         self.comms = comms
         self.max_temp = float(max_temp)
         self.current_target = 0.0  # Track current target temperature
-        print(f"Hotplate initialized using {type(self.comms).__name__}: max_temp={self.max_temp}°C")
+        log.info("Hotplate initialized using %s: max_temp=%s°C", type(self.comms).__name__, self.max_temp)
+
+    def _limit_target(self, target_temp: float) -> float:
+        """Clamps target_temp to 0..max_temp, warning when it had to be changed."""
+        if target_temp < 0:
+            log.warning("Target temperature cannot be negative. Setting to 0°C.")
+            return 0.0
+        if target_temp > self.max_temp:
+            log.warning("Target temperature %s°C exceeds maximum %s°C. Limiting to maximum.", target_temp, self.max_temp)
+            return self.max_temp
+        return target_temp
 
     def set_temperature(self, target_temp: float) -> bool:
         """
@@ -38,15 +58,10 @@ class Hotplate:
         Returns:
             bool: True if commands were sent successfully.
         """
-        print(f"\n[{time.strftime('%H:%M:%S')}] Setting hotplate temperature: {target_temp}°C")
+        log.info("Setting hotplate temperature: %s°C", target_temp)
 
         # Safety check for temperature limits
-        if target_temp < 0:
-            print("Warning: Target temperature cannot be negative. Setting to 0°C.")
-            target_temp = 0.0
-        elif target_temp > self.max_temp:
-            print(f"Warning: Target temperature {target_temp}°C exceeds maximum {self.max_temp}°C. Limiting to maximum.")
-            target_temp = self.max_temp
+        target_temp = self._limit_target(target_temp)
 
         # Update current target
         self.current_target = target_temp
@@ -55,9 +70,9 @@ class Hotplate:
         success = self.comms.send_command("set_bed_temp", S=f"{target_temp:.1f}")
 
         if success:
-            print(f"[{time.strftime('%H:%M:%S')}] Hotplate temperature set to {target_temp}°C")
+            log.info("Hotplate temperature set to %s°C", target_temp)
         else:
-            print(f"[{time.strftime('%H:%M:%S')}] Failed to set hotplate temperature")
+            log.error("Failed to set hotplate temperature")
         
         return success
 
@@ -72,15 +87,10 @@ class Hotplate:
         Returns:
             bool: True if commands were sent successfully.
         """
-        print(f"\n[{time.strftime('%H:%M:%S')}] Heating hotplate to {target_temp}°C and waiting...")
+        log.info("Heating hotplate to %s°C and waiting...", target_temp)
 
         # Safety check for temperature limits
-        if target_temp < 0:
-            print("Warning: Target temperature cannot be negative. Setting to 0°C.")
-            target_temp = 0.0
-        elif target_temp > self.max_temp:
-            print(f"Warning: Target temperature {target_temp}°C exceeds maximum {self.max_temp}°C. Limiting to maximum.")
-            target_temp = self.max_temp
+        target_temp = self._limit_target(target_temp)
 
         # Update current target
         self.current_target = target_temp
@@ -89,9 +99,9 @@ class Hotplate:
         success = self.comms.send_command("set_bed_temp_wait", S=f"{target_temp:.1f}")
 
         if success:
-            print(f"[{time.strftime('%H:%M:%S')}] Hotplate heating to {target_temp}°C with wait command sent")
+            log.info("Hotplate heating to %s°C with wait command sent", target_temp)
         else:
-            print(f"[{time.strftime('%H:%M:%S')}] Failed to send heat and wait command")
+            log.error("Failed to send heat and wait command")
         
         return success
 
@@ -102,7 +112,7 @@ class Hotplate:
         Returns:
             bool: True if commands were sent successfully.
         """
-        print(f"\n[{time.strftime('%H:%M:%S')}] Turning off hotplate")
+        log.info("Turning off hotplate")
 
         # Set target to 0
         self.current_target = 0.0
@@ -111,9 +121,9 @@ class Hotplate:
         success = self.comms.send_command("set_bed_temp", S="0")
 
         if success:
-            print(f"[{time.strftime('%H:%M:%S')}] Hotplate turned off")
+            log.info("Hotplate turned off")
         else:
-            print(f"[{time.strftime('%H:%M:%S')}] Failed to turn off hotplate")
+            log.error("Failed to turn off hotplate")
         
         return success
 
@@ -124,18 +134,56 @@ class Hotplate:
         Returns:
             bool: True if command was sent successfully.
         """
-        print(f"\n[{time.strftime('%H:%M:%S')}] Requesting hotplate temperature")
+        log.info("Requesting hotplate temperature")
 
         # Send temperature report command
         success = self.comms.send_command("get_temp")
 
         if success:
-            print(f"[{time.strftime('%H:%M:%S')}] Temperature request sent")
+            log.info("Temperature request sent")
         else:
-            print(f"[{time.strftime('%H:%M:%S')}] Failed to request temperature")
+            log.error("Failed to request temperature")
         
         return success
 
+    def set_and_report(self, target_temp: float) -> dict | None:
+        """
+        Sets the hotplate target and reads back the bed temperature in one send (M140 + M105 batch).
+
+        Args:
+            target_temp (float): Target temperature in Celsius.
+
+        Returns:
+            dict | None: {'bed': current °C, 'target': firmware target °C}, or None if sending failed
+                         or no temperature report arrived within REPORT_TIMEOUT.
+        """
+        log.info("Setting hotplate temperature to %s°C and reading it back", target_temp)
+        target_temp = self._limit_target(target_temp)
+        self.current_target = target_temp
+
+        # Registered before sending, so a fast reply can't slip past; the reader thread delivers it even if
+        # another send clears message_queue in the meantime
+        reports = []; reported = threading.Event()
+        def on_report(match):
+            if not reports: reports.append(match); reported.set()
+        token = self.comms.register_line_matcher(self.bed_temp_pattern, on_report)
+        try:
+            # Neither command waits, so the batch returns once written
+            if not self.comms.send_batch([("set_bed_temp", {"S": f"{target_temp:.1f}"}), ("get_temp", {})]):
+                log.error("Failed to set hotplate temperature"); return None
+            deadline = time.monotonic() + self.REPORT_TIMEOUT
+            # Short slices only so a disconnect ends the wait early; the report itself wakes it at once
+            while not reported.wait(min(self.DISCONNECT_CHECK_INTERVAL, max(0.0, deadline - time.monotonic()))):
+                if time.monotonic() >= deadline: log.warning("No temperature report received"); return None
+                if not self.comms.is_connected: log.error("Disconnected while waiting for the temperature report"); return None
+        finally:
+            self.comms.unregister_line_matcher(token)
+
+        match = reports[0]
+        report = {'bed': float(match.group(1)), 'target': float(match.group(2))}
+        log.info("Hotplate at %s°C (target %s°C)", report['bed'], report['target'])
+        return report
+
     def get_current_target(self) -> float:
         """
         Returns the current target temperature.
@@ -1,33 +1,79 @@
-import time
-import math 
-from comms.wifi_handler import WifiHandler
-from comms.serial_handler import SerialHandler
+import logging
+import functools
+from comms.base_handler import CommsProtocol # Light: neither transport (pyserial/websocket) is imported
 
+# Timestamps come from the logging formatter configured in Main.py
+log = logging.getLogger(__name__)
+
+
+# Protocols repeat the same doses, so the G-code parameter strings are memoized
+@functools.lru_cache(maxsize=256)
+def _fmt4(x: float) -> str: return f"{x:.4f}"
+
+@functools.lru_cache(maxsize=256)
+def _fmt2(x: float) -> str: return f"{x:.2f}"
 
 
 class Pump:
     """Control the peristaltic pump using the 3d printer extruder (Simplified, Handler Agnostic)."""
+    __slots__ = ('comms', 'mm_per_ml', 'max_feedrate_mm_min')
 
     
-    def __init__(self, comms, mm_per_ml: float = 41.0):
+    def __init__(self, comms, mm_per_ml: float = 41.0, max_feedrate_mm_min: float | None = None):
         """
         Initializes the pump controller.
 
         Args:
             comms (WifiHandler | SerialHandler): The handler instance for sending commands.
             mm_per_ml (float): Calibration factor: mm extruder move per mL pumped.
+            max_feedrate_mm_min (float | None): Fastest extruder feedrate the pump may be driven at;
+                                                moves above it are refused. None (default) means no limit.
         """
         # Runtime check for either handler type is still important
-        if not isinstance(comms, (WifiHandler, SerialHandler)):
-             raise TypeError("Communicator must be an instance of WifiHandler or SerialHandler")
-        if not isinstance(mm_per_ml, (int, float)) or mm_per_ml <= 0:
+        if not isinstance(comms, CommsProtocol):
+             raise TypeError("Communicator must be a G-code handler (e.g. WifiHandler or SerialHandler)")
+        try: mm_per_ml = float(mm_per_ml)
+        except (TypeError, ValueError): raise ValueError("mm_per_ml must be a positive number.") from None
+        if not mm_per_ml > 0:
              raise ValueError("mm_per_ml must be a positive number.")
+        if max_feedrate_mm_min is not None:
+            try: max_feedrate_mm_min = float(max_feedrate_mm_min)
+            except (TypeError, ValueError): raise ValueError("max_feedrate_mm_min must be a positive number or None.") from None
+            if not max_feedrate_mm_min > 0:
+                 raise ValueError("max_feedrate_mm_min must be a positive number or None.")
 
         # Minimal init: Store communicator and calibration
         self.comms = comms
-        self.mm_per_ml = float(mm_per_ml)
+        self.mm_per_ml = mm_per_ml
+        self.max_feedrate_mm_min = max_feedrate_mm_min
         # Removed default rate storage, as it's not used when rate is mandatory
-        print(f"Pump initialized using {type(self.comms).__name__}: mm_per_ml={self.mm_per_ml}")
+        log.info("Pump initialized using %s: mm_per_ml=%s, max_feedrate_mm_min=%s", type(self.comms).__name__, self.mm_per_ml, self.max_feedrate_mm_min)
+
+    def _validate(self, volume_ml: float, flowrate_ml_min: float) -> tuple:
+        """
+        Converts a volume and flowrate into extruder move parameters in one pass.
+
+        Returns:
+            tuple: (ok, distance_mm, feedrate_mm_min, err). ok is False (with err set)
+                   for non-numeric input, a zero flowrate or one above max_feedrate_mm_min; distance_mm is 0.0 when there is nothing to pump.
+        """
+        try:
+            volume_ml = float(volume_ml); flowrate_ml_min = float(flowrate_ml_min)
+        except (TypeError, ValueError):
+            return False, 0.0, 0.0, f"Non-numeric pump input (volume={volume_ml!r}, flowrate={flowrate_ml_min!r})."
+
+        mm_per_ml = self.mm_per_ml
+        distance_mm = volume_ml * mm_per_ml # E can be negative
+        feedrate_mm_min = abs(flowrate_ml_min) * mm_per_ml # F must be positive
+        # A zero rate can never deliver anything, so it is bad input rather than a no-op
+        if not feedrate_mm_min > 0.0:
+            return False, 0.0, 0.0, f"Flowrate must be non-zero (got {flowrate_ml_min!r} mL/min); pump will not move."
+        max_feedrate = self.max_feedrate_mm_min
+        if max_feedrate is not None and feedrate_mm_min > max_feedrate:
+            return False, 0.0, 0.0, (f"Flowrate {flowrate_ml_min!r} mL/min needs F{feedrate_mm_min:.2f} mm/min, above the "
+                                     f"pump maximum of {max_feedrate} mm/min ({max_feedrate / mm_per_ml:.2f} mL/min); pump will not move.")
+        if abs(distance_mm) < 1e-9: return True, 0.0, feedrate_mm_min, None
+        return True, distance_mm, feedrate_mm_min, None
 
     def pump_volume(self, volume_ml: float, flowrate_ml_min: float) -> bool:
         """
@@ -40,27 +86,25 @@ class Pump:
         Returns:
             bool: True if commands were sent successfully.
         """
-        print(f"\n[{time.strftime('%H:%M:%S')}] Pumping volume: {volume_ml} mL at {flowrate_ml_min} mL/min")
-
-        # Calculate G-code parameters
-        distance_mm = volume_ml * self.mm_per_ml
-        # Feedrate F must be positive
-        feedrate_mm_min = abs(flowrate_ml_min * self.mm_per_ml) # Use abs for safety
+        log.info("Pumping volume: %s mL at %s mL/min", volume_ml, flowrate_ml_min)
 
+        # Calculate and validate G-code parameters
+        ok, distance_mm, feedrate_mm_min, err = self._validate(volume_ml, flowrate_ml_min)
+        if not ok: log.error(err); return False
         # Avoid sending move if distance is zero
-        if math.isclose(distance_mm, 0.0, abs_tol=1e-9):
-             print("Warning: Calculated distance is zero, pump will not move.")
+        if not distance_mm:
+             log.warning("Calculated distance is zero, pump will not move.")
              return True # No command needed, consider this success
 
-        print(f"  Calculated: E={distance_mm:.4f} mm, F={feedrate_mm_min:.2f} mm/min")
+        log.info("  Calculated: E=%.4f mm, F=%.2f mm/min", distance_mm, feedrate_mm_min)
 
-        # Send commands sequentially
-        success = self.comms.send_command("set_extruder_relative")
-        if success:
-            # Send the move command (E can be negative, F must be positive)
-            success = self.comms.send_command("pump_move", E=f"{distance_mm:.4f}", F=f"{feedrate_mm_min:.2f}")
+        # Send mode switch + move as one batch (E can be negative, F must be positive)
+        success = self.comms.send_batch([
+            ("set_extruder_relative", {}),
+            ("pump_move", {"E": _fmt4(distance_mm), "F": _fmt2(feedrate_mm_min)}),
+        ])
 
-        print(f"[{time.strftime('%H:%M:%S')}] Pump volume finished. Overall Success: {success}")
+        log.info("Pump volume finished. Overall Success: %s", success)
         return success
 
     def pump_duration(self, duration_s: float, flowrate_ml_min: float) -> bool:
@@ -74,30 +118,29 @@ class Pump:
         Returns:
             bool: True if commands were sent successfully.
         """
-        print(f"\n[{time.strftime('%H:%M:%S')}] Pumping duration: {duration_s} s at {flowrate_ml_min} mL/min") # Corrected print
+        log.info("Pumping duration: %s s at %s mL/min", duration_s, flowrate_ml_min)
 
 
-        # Calculate G-code parameters
-        # Feedrate F must be positive, based on the magnitude of the rate
-        feedrate_mm_min = abs(flowrate_ml_min * self.mm_per_ml)
-        # Distance E depends on rate (including sign) and duration
-        rate_mm_per_s = (flowrate_ml_min * self.mm_per_ml) / 60.0
-        distance_mm = rate_mm_per_s * duration_s
+        # Volume depends on rate (including sign) and duration
+        try: volume_ml = float(flowrate_ml_min) * float(duration_s) / 60.0
+        except (TypeError, ValueError): log.error("Non-numeric pump input (duration=%r, flowrate=%r).", duration_s, flowrate_ml_min); return False
 
-        # Avoid sending move if distance is zero or feedrate is zero
-        # Use math.isclose for float comparison
-        if math.isclose(distance_mm, 0.0, abs_tol=1e-9) or math.isclose(feedrate_mm_min, 0.0, abs_tol=1e-9):
-             print("Warning: Calculated distance or feedrate is zero, pump will not move.")
+        # Calculate and validate G-code parameters
+        ok, distance_mm, feedrate_mm_min, err = self._validate(volume_ml, flowrate_ml_min)
+        if not ok: log.error(err); return False
+        # Avoid sending move if distance is zero
+        if not distance_mm:
+             log.warning("Calculated distance is zero, pump will not move.")
              return True # No command needed, consider this success
 
-        print(f"  Calculated: E={distance_mm:.4f} mm, F={feedrate_mm_min:.2f} mm/min")
+        log.info("  Calculated: E=%.4f mm, F=%.2f mm/min", distance_mm, feedrate_mm_min)
 
-        # Send commands sequentially
-        success = self.comms.send_command("set_extruder_relative")
-        if success:
-            # Send the move command (E can be negative, F must be positive)
-            success = self.comms.send_command("pump_move", E=f"{distance_mm:.4f}", F=f"{feedrate_mm_min:.2f}")
+        # Send mode switch + move as one batch (E can be negative, F must be positive)
+        success = self.comms.send_batch([
+            ("set_extruder_relative", {}),
+            ("pump_move", {"E": _fmt4(distance_mm), "F": _fmt2(feedrate_mm_min)}),
+        ])
 
-        print(f"[{time.strftime('%H:%M:%S')}] Pump duration finished. Overall Success: {success}") # Corrected print
+        log.info("Pump duration finished. Overall Success: %s", success)
         return success
 
@@ -1,12 +1,140 @@
-import time
-import math
 import json
+import math
 import os
+import atexit
 import sys
 import re
-from queue import Queue, Empty
-from comms.wifi_handler import WifiHandler
-from comms.serial_handler import SerialHandler
+import logging
+import functools
+import threading
+from comms.base_handler import CommsProtocol # Light: neither transport (pyserial/websocket) is imported
+from comms.ram_cache import cached_path
+
+# orjson is optional: it parses bytes directly and is faster on slow SD storage
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = lambda data: json.loads(data.decode('utf-8'))
+
+# Timestamps come from the logging formatter configured in Main.py
+log = logging.getLogger(__name__)
+
+_INIT_GCODE_CACHE: dict[str, tuple[int, tuple]] = {} # path -> (st_mtime_ns, commands)
+_LOCATIONS_CACHE: dict[str, tuple[int, dict]] = {} # path -> (st_mtime_ns, parsed locations)
+# M114 position report; searched (not matched) since some firmwares prefix it, e.g. "ok X:..."
+_M114_RE = re.compile(r"X:([-\d\.]+) Y:([-\d\.]+) Z:([-\d\.]+) E:([-\d\.]+)")
+
+
+def _read_init_gcode(filepath: str) -> tuple:
+    """Returns the file's G-code lines without comments/blanks, re-parsing only when its mtime changed."""
+    mtime = os.stat(filepath).st_mtime_ns
+    hit = _INIT_GCODE_CACHE.get(filepath)
+    if hit and hit[0] == mtime: return hit[1]
+    commands = []
+    with open(filepath, 'r') as f:
+        for line in f:
+            cleaned_line = line.split(';', 1)[0].strip()
+            if cleaned_line: commands.append(cleaned_line)
+    commands = tuple(commands)
+    _INIT_GCODE_CACHE[filepath] = (mtime, commands)
+    return commands
+
+
+def _read_locations(filepath: str) -> dict:
+    """Returns a fresh copy of the file's locations, re-parsing the JSON only when its mtime changed."""
+    mtime = os.stat(filepath).st_mtime_ns
+    hit = _LOCATIONS_CACHE.get(filepath)
+    if not (hit and hit[0] == mtime):
+        with open(cached_path(filepath), 'rb') as f: locations = _json_loads(f.read())
+        hit = _LOCATIONS_CACHE[filepath] = (mtime, locations)
+    return dict(hit[1]) # Callers edit their copy (add_location), never the cached dict
+
+
+def _write_locations(filepath: str, locations: dict) -> bool:
+    """Writes locations to filepath atomically (temp file + os.replace) and refreshes the parse cache."""
+    temp_filepath = filepath + ".tmp"
+    try:
+        with open(temp_filepath, 'w') as f: json.dump(locations, f, indent=4)
+        os.replace(temp_filepath, filepath)
+        # Keep the parse cache in step with what was just written
+        _LOCATIONS_CACHE[filepath] = (os.stat(filepath).st_mtime_ns, locations)
+        log.info("Saved locations to %s", filepath) # Confirmation
+        return True
+    except Exception as e:
+        log.error("Error saving locations to %s: %s", filepath, e)
+        # Attempt to remove temporary file if it exists
+        if os.path.exists(temp_filepath):
+            try:
+                 os.remove(temp_filepath)
+            except Exception as remove_e:
+                 log.warning("Could not remove temp file %s: %s", temp_filepath, remove_e)
+        return False
+
+
+
+# GUI jog buttons repeat the same few (dx, dy, dz, speed) combinations
+@functools.lru_cache(maxsize=256)
+def _rel_move_gcode(dx: float, dy: float, dz: float, speed: float | None) -> tuple[str, bytes]:
+    """Returns the G91 / move / G90 payload for a relative move and its wire bytes."""
+    words = ["G1"]
+    if dx != 0: words.append(f"X{dx:.3f}")
+    if dy != 0: words.append(f"Y{dy:.3f}")
+    if dz != 0: words.append(f"Z{dz:.3f}")
+    # Relative mode first, the move only if an axis moves (with speed if specified), then always back to absolute
+    if len(words) > 1:
+        if speed is not None: words.append(f"F{speed:.1f}")
+        payload = f"G91\n{' '.join(words)}\nG90"
+    else: payload = "G91\nG90"
+    return payload, (payload + "\n").encode('utf-8')
+
+# Background writer for add_location: only the newest snapshot per file is kept, so a burst
+# of updates (e.g. a calibration run) costs one write instead of one per call
+_PENDING_SAVES: dict[str, dict] = {} # path -> latest locations snapshot not yet written
+_SAVE_CV = threading.Condition()
+_saver_state = {'thread': None, 'busy': False}
+_FAILED_SAVES: set[str] = set() # paths whose most recent background write failed
+
+
+def _saver_loop():
+    while True:
+        with _SAVE_CV:
+            _SAVE_CV.wait_for(lambda: _PENDING_SAVES)
+            filepath, locations = _PENDING_SAVES.popitem(); _saver_state['busy'] = True
+        saved = False
+        try: saved = _write_locations(filepath, locations)
+        finally:
+            with _SAVE_CV:
+                if saved: _FAILED_SAVES.discard(filepath)
+                else: _FAILED_SAVES.add(filepath)
+                _saver_state['busy'] = False; _SAVE_CV.notify_all()
+
+
+def _queue_save(filepath: str, locations: dict):
+    """Hands a locations snapshot to the writer thread (started on first use) and returns immediately."""
+    with _SAVE_CV:
+        _PENDING_SAVES[filepath] = locations
+        if _saver_state['thread'] is None:
+            _saver_state['thread'] = threading.Thread(target=_saver_loop, name="locations-saver", daemon=True)
+            _saver_state['thread'].start()
+            atexit.register(flush_saves) # The thread is a daemon, so pending writes are finished here
+        _SAVE_CV.notify_all()
+
+
+def flush_saves(timeout: float | None = None, filepath: str | None = None) -> bool:
+    """
+    Blocks until every queued locations write has finished.
+
+    Args:
+        timeout (float | None): Max seconds to wait; None waits as long as it takes.
+        filepath (str | None): File whose save result is reported; None checks every file.
+
+    Returns:
+        bool: True if the writes finished and the latest write of filepath (or of every file) succeeded;
+              False on timeout or if that write failed (the error is logged by the writer).
+    """
+    with _SAVE_CV:
+        if not _SAVE_CV.wait_for(lambda: not _PENDING_SAVES and not _saver_state['busy'], timeout): return False
+        return filepath not in _FAILED_SAVES if filepath is not None else not _FAILED_SAVES
 
 
 
@@ -16,6 +144,11 @@ class Robot:
     Handles movement commands and applying initial configuration.
     Reads named locations directly from a JSON file.
     """
+    __slots__ = ('comms', 'safe_z', 'default_speed', 'current_pos', 'locations_filepath', 'locations',
+                 'init_gcode_filepath', 'init_gcode_commands', '_location_index', '_loc_cache')
+    m114_pattern = _M114_RE # Compiled once per process, shared by all instances
+    POSITION_TIMEOUT = 5.0 # Seconds get_position waits for the M114 report
+    SAVE_TIMEOUT = 10.0 # Seconds add_location / _load_locations wait for the locations file write
 
 
     def __init__(self, communicator, # No type hint here, but checked below
@@ -35,8 +168,8 @@ class Robot:
             default_speed (float | None): Default travel speed (mm/min) if not specified.
         """
         # Runtime check remains important
-        if not isinstance(communicator, (WifiHandler, SerialHandler)):
-             raise TypeError("Communicator must be an instance of WifiHandler or SerialHandler")
+        if not isinstance(communicator, CommsProtocol):
+             raise TypeError("Communicator must be a G-code handler (e.g. WifiHandler or SerialHandler)")
         # Other validation remains the same
         if not isinstance(safe_z, (int, float)):
              raise TypeError("safe_z must be a number")
@@ -54,11 +187,12 @@ class Robot:
         self.current_pos = {'x': None, 'y': None, 'z': None, 'e': None}
         self.locations_filepath = locations_filepath
         self.locations = {}
+        self._location_index = None # (names, coords) columns of self.locations, built on first nearest_location()
+        self._loc_cache = {} # name -> validated (x, y, z) floats, filled by move_to_location
         self.init_gcode_filepath = init_gcode_filepath
-        self.init_gcode_commands = []
-        self.m114_pattern = re.compile(r"X:([-\d\.]+) Y:([-\d\.]+) Z:([-\d\.]+) E:([-\d\.]+)")
+        self.init_gcode_commands = ()
 
-        print(f"Robot initialized using {type(self.comms).__name__}: safe_z={self.safe_z}, default_speed={self.default_speed}")
+        log.info("Robot initialized using %s: safe_z=%s, default_speed=%s", type(self.comms).__name__, self.safe_z, self.default_speed)
         # Re-added call to load locations
         self._load_locations()
         self._load_init_gcode()
@@ -68,95 +202,109 @@ class Robot:
 
     def _load_locations(self):
         """Loads locations from the JSON file specified in self.locations_filepath."""
+        # A queued add_location write must land before the file is re-read; bounded so a hung disk can't block Robot()
+        if not flush_saves(self.SAVE_TIMEOUT, self.locations_filepath):
+            log.warning("Queued writes to %s failed or did not finish within %ss; loading the file as it is.", self.locations_filepath, self.SAVE_TIMEOUT)
         if os.path.exists(self.locations_filepath):
             try:
-                with open(self.locations_filepath, 'r') as f:
-                    self.locations = json.load(f)
-                print(f"Loaded {len(self.locations)} locations from {self.locations_filepath}")
-            except json.JSONDecodeError:
-                print(f"Error: Could not decode JSON from {self.locations_filepath}. No locations loaded.")
+                self.locations = _read_locations(self.locations_filepath)
+                log.info("Loaded %s locations from %s", len(self.locations), self.locations_filepath)
+            except ValueError: # json and orjson decode errors both subclass it
+                log.error("Could not decode JSON from %s. No locations loaded.", self.locations_filepath)
                 self.locations = {}
             except Exception as e:
-                print(f"Error loading locations file {self.locations_filepath}: {e}")
+                log.error("Error loading locations file %s: %s", self.locations_filepath, e)
                 self.locations = {}
         else:
-            print(f"Location file {self.locations_filepath} not found. No locations loaded.")
+            log.info("Location file %s not found. No locations loaded.", self.locations_filepath)
             self.locations = {}
+        self._location_index = None; self._loc_cache.clear()
 
 
     def _save_locations(self) -> bool:
-        """Saves the current locations dictionary back to the JSON file."""
-        temp_filepath = self.locations_filepath + ".tmp"
-        try:
-            with open(temp_filepath, 'w') as f: json.dump(self.locations, f, indent=4)
-            os.replace(temp_filepath, self.locations_filepath);
-            print(f"Saved locations to {self.locations_filepath}") # Confirmation
-            return True
-        except Exception as e:
-            print(f"Error saving locations to {self.locations_filepath}: {e}")
-            # Attempt to remove temporary file if it exists
-            if os.path.exists(temp_filepath):
-                # --- FIX: Use standard indentation for inner try/except ---
-                try:
-                     os.remove(temp_filepath)
-                except Exception as remove_e:
-                     # Optionally log the remove error, but don't stop the outer exception handling
-                     print(f"  Warning: Could not remove temp file {temp_filepath}: {remove_e}")
-                # --- End FIX ---
-            return False # This should now be parsed correctly
+        """Saves the current locations dictionary back to the JSON file (blocking; add_location queues instead)."""
+        return _write_locations(self.locations_filepath, dict(self.locations))
 
     def _load_init_gcode(self):
-        """Loads G-code commands from the init file, skipping comments/empty lines."""
-        self.init_gcode_commands = [];
+        """Loads G-code commands from the init file (cached by mtime), skipping comments/empty lines."""
+        commands = ();
         if self.init_gcode_filepath and os.path.exists(self.init_gcode_filepath):
             try:
-                with open(self.init_gcode_filepath, 'r') as f:
-                    for line in f:
-                        cleaned_line = line.strip(); comment_index = cleaned_line.find(';');
-                        if comment_index != -1: cleaned_line = cleaned_line[:comment_index].strip()
-                        if cleaned_line: self.init_gcode_commands.append(cleaned_line)
-                print(f"Loaded {len(self.init_gcode_commands)} init G-code commands from {self.init_gcode_filepath}")
-            except Exception as e: print(f"Error loading init G-code file {self.init_gcode_filepath}: {e}")
-        elif self.init_gcode_filepath: print(f"Warning: Init G-code file not found: {self.init_gcode_filepath}")
+                commands = _read_init_gcode(self.init_gcode_filepath)
+                if commands is not self.init_gcode_commands: # Only report a fresh parse
+                    log.info("Loaded %s init G-code commands from %s", len(commands), self.init_gcode_filepath)
+            except Exception as e: log.error("Error loading init G-code file %s: %s", self.init_gcode_filepath, e)
+        elif self.init_gcode_filepath: log.warning("Init G-code file not found: %s", self.init_gcode_filepath)
+        self.init_gcode_commands = commands
 
     def _get_speed(self, speed: float | None = None) -> float | None:
         """Returns the speed to use (provided or default), or None."""
-        if speed is not None:
-            if not isinstance(speed, (int, float)) or speed <= 0: print(f"Warning: Invalid speed specified ({speed}), using default."); return self.default_speed
-            return float(speed)
-        return self.default_speed
+        if speed is None: return self.default_speed
+        # One comparison for the usual numeric speed; non-numbers raise TypeError, NaN and <= 0 fail it
+        try:
+            if speed > 0: return float(speed)
+        except TypeError: pass
+        log.warning("Invalid speed specified (%s), using default.", speed); return self.default_speed
 
     # --- Public Methods ---
     def apply_initial_config(self) -> bool:
-        """Sends the loaded initial G-code commands to the controller."""
-        if not self.init_gcode_commands: print("No initial G-code commands loaded."); return True
-        print(f"\n[{time.strftime('%H:%M:%S')}] Applying {len(self.init_gcode_commands)} initial config commands...")
+        """Sends the initial G-code commands to the controller, picking up edits to the init file."""
+        self._load_init_gcode() # One os.stat() when the file is unchanged
+        if not self.init_gcode_commands: log.info("No initial G-code commands loaded."); return True
+        log.info("Applying %s initial config commands...", len(self.init_gcode_commands))
+        commands = self.init_gcode_commands; total = len(commands)
+        # Lines go out in groups as large as the handler's in-flight window, so each send fits the
+        # firmware's command buffer; send_raw_gcode blocks until the previous group has room
+        group = max(1, self.comms.inflight_limit)
         all_sent_ok = True
-        for i, command in enumerate(self.init_gcode_commands):
-            print(f"  Sending init command {i+1}/{len(self.init_gcode_commands)}: {command}")
-            if not self.comms.send_raw_gcode(command):
-                print(f"  Error: Failed to send init command: {command}"); all_sent_ok = False; # break
-            time.sleep(0.05)
-        print(f"Finished applying initial configuration commands. Success: {all_sent_ok}"); return all_sent_ok
+        for start in range(0, total, group):
+            chunk = commands[start:start + group]
+            log.info("  Sending init commands %s-%s/%s: %s", start + 1, start + len(chunk), total, "; ".join(chunk))
+            if not self.comms.send_raw_gcode("\n".join(chunk)):
+                log.error("Failed to send init commands: %s", "; ".join(chunk)); all_sent_ok = False; # break
+        # One wait at the end for the remaining 'ok's instead of pacing every line
+        if not self.comms.drain(): log.warning("Not every init command was acknowledged.")
+        log.info("Finished applying initial configuration commands. Success: %s", all_sent_ok); return all_sent_ok
 
     def home(self, axes: str = 'xyz') -> bool:
-        """Homes the specified axes and attempts to update position."""
-        print(f"\n[{time.strftime('%H:%M:%S')}] Homing axes: {axes}")
+        """Homes the specified axes and updates position, from Marlin's post-G28 report when it sends one."""
+        log.info("Homing axes: %s", axes)
         if 'x' in axes.lower() or 'y' in axes.lower() or 'z' in axes.lower():
-             success = self.comms.send_command("home_all") # Assumes this waits
+             # Every axis moves during homing; stays unknown unless a position report arrives
+             self.current_pos = {'x': None, 'y': None, 'z': None, 'e': None}
+             # Marlin reports the position when homing completes; catching it here saves the M114 round-trip
+             reports = []
+             token = self.comms.register_line_matcher(self.m114_pattern, reports.append)
+             try: success = self.comms.send_command("home_all") # Assumes this waits
+             finally: self.comms.unregister_line_matcher(token)
              if success:
-                 print("Homing command successful. Attempting to get position...")
-                 # Try to get actual position to confirm home location
-                 self.get_position(update_internal=True) # Call the updated get_position
-                 print(f"Homing sequence finished. Current position: {self.current_pos}")
+                 pos = self._parse_position(reports[-1]) if reports else None
+                 if pos: log.info("Homing command successful. Position reported: %s", pos); self.current_pos = pos
+                 else:
+                     log.info("Homing command successful. Attempting to get position...")
+                     # Try to get actual position to confirm home location
+                     self.get_position(update_internal=True) # Call the updated get_position
+                 log.info("Homing sequence finished. Current position: %s", self.current_pos)
              return success
-        else: print("No valid axes specified for homing."); return False
+        else: log.info("No valid axes specified for homing."); return False
+
+    @staticmethod
+    def _parse_position(pos_match) -> dict | None:
+        """Converts an m114_pattern match to {'x', 'y', 'z', 'e'} floats, or None if a group isn't a number."""
+        try:
+            return {
+                'x': float(pos_match.group(1)),
+                'y': float(pos_match.group(2)),
+                'z': float(pos_match.group(3)),
+                'e': float(pos_match.group(4))
+            }
+        except (ValueError, IndexError) as parse_e:
+            log.error("Error parsing numbers from M114 match: %s. Error: %s", pos_match.groups(), parse_e); return None
 
    
     def get_position(self, update_internal: bool = True) -> dict | None:
         """
-        Sends M114, then reads the queue looking for BOTH the position
-        report and the 'ok' confirmation.
+        Sends M114 and blocks until the handler's reader thread sees the position report.
 
         Args:
             update_internal (bool): If True (default), updates self.current_pos.
@@ -165,130 +313,112 @@ class Robot:
             dict | None: Dictionary {'x': float, 'y': float, 'z': float, 'e': float}
                          or None if sending/parsing fails or timeout occurs.
         """
-        print(f"[{time.strftime('%H:%M:%S')}] Requesting position (M114)...")
-
-        # --- Prerequisites Check (Good to keep) ---
-        if not hasattr(self.comms, 'message_queue') or not isinstance(self.comms.message_queue, Queue):
-            print("Error: Communicator object missing valid 'message_queue'.")
-            return None
-        # Optional: Check for _clear_queue if you still want to use it
-        # if hasattr(self.comms, '_clear_queue'):
-        #     try: self.comms._clear_queue()
-        #     except Exception as e: print(f"Error calling _clear_queue: {e}")
-        # else:
-        #      print("Warning: Communicator object missing '_clear_queue'. Queue not cleared.")
-
-
-
-        # Using placeholder for the non-waiting send:
-        if not self.comms.send_command("get_position", wait=False): # *** MODIFICATION POINT ***
-            print("Error: Failed to send M114 command.")
-            # If send_command doesn't support wait=False, use the direct send method:
-            # if not self.comms.send("M114"):
-            #     print("Error: Failed to send M114 command directly.")
-            #     return None
-            return None # Added return here if send fails
-
-        # --- Search queue for BOTH position report AND 'ok' ---
-        print("  M114 sent. Searching queue for position report and 'ok'...")
-        found_pos_data = None
-        found_ok = False
-        search_start_time = time.time()
-        # Increased timeout slightly, as we wait for both pieces of info now
-        search_timeout = 5.0
-
-        while time.time() - search_start_time < search_timeout:
-            try:
-                # Use a short timeout on get()
-                message = self.comms.message_queue.get(timeout=0.1)
-                # print(f"  [GetPos Check] Queue item: '{message}'") # Verbose Debug
-
-                # Check for position report
-                pos_match = self.m114_pattern.search(message)
-                if pos_match and found_pos_data is None: # Process only the first match
-                    try:
-                        pos = {
-                            'x': float(pos_match.group(1)),
-                            'y': float(pos_match.group(2)),
-                            'z': float(pos_match.group(3)),
-                            'e': float(pos_match.group(4))
-                        }
-                        found_pos_data = pos
-                        print(f"  Parsed position: {found_pos_data}")
-                        # Update internal position immediately if requested
-                        if update_internal:
-                            print("  Updating internal robot position.")
-                            self.current_pos = found_pos_data
-                    except (ValueError, IndexError) as parse_e:
-                        print(f"  Error parsing numbers from M114 match: {pos_match.groups()}. Error: {parse_e}")
-                    # Do NOT break yet, still need the 'ok'
-
-                # Check for 'ok'
-                if self.ok_pattern.search(message):
-                     print("  'ok' received.")
-                     found_ok = True
-
-                # Exit loop ONLY if both are found
-                if found_pos_data and found_ok:
-                    break
-
-            except Empty:
-                # Queue is temporarily empty, continue waiting if timeout not reached
-                # If we already found both, we can exit early
-                if found_pos_data and found_ok:
-                     break
-                # No need to sleep, timeout=0.1 in get() handles polling delay
-                pass
-            except Exception as e:
-                print(f"  Error reading message queue during position search: {e}")
-                # Optionally log traceback: import traceback; traceback.print_exc()
-                break # Stop on unexpected errors
-
-        # --- Check results after loop ---
-        if found_pos_data and found_ok:
-            print(f"[{time.strftime('%H:%M:%S')}] Position retrieved successfully.")
-            return found_pos_data
-        elif found_pos_data:
-            print("Warning: Found position report but did not receive 'ok' within timeout.")
-            # Decide whether to return potentially valid position without 'ok' or None
-            return found_pos_data # Or return None
-        elif found_ok:
-            print("Warning: Received 'ok' but did not find position report within timeout.")
-            return None
-        else:
-            print("Warning: Timed out waiting for position report and/or 'ok'.")
-            return None
+        log.info("Requesting position (M114)...")
+
+        # Registered before sending, so a fast reply can't slip past; the line itself stays queued
+        reports = []; reported = threading.Event()
+        def on_report(match):
+            if not reports: reports.append(match); reported.set()
+        token = self.comms.register_line_matcher(self.m114_pattern, on_report)
+        try:
+            if not self.comms.send_command("get_position"):
+                log.error("Failed to send M114 command."); return None
+            log.info("  M114 sent. Waiting for position report...")
+            if not reported.wait(self.POSITION_TIMEOUT):
+                log.warning("Timed out waiting for position report."); return None
+        finally:
+            self.comms.unregister_line_matcher(token)
+
+        pos = self._parse_position(reports[0])
+        if pos is None: return None
+        log.info("  Parsed position: %s", pos)
+        if update_internal:
+            log.info("  Updating internal robot position.")
+            self.current_pos = pos
+        log.info("Position retrieved successfully.")
+        return pos
+
+    async def get_position_async(self, update_internal: bool = True) -> dict | None:
+        """
+        Like get_position(), but awaits the M114 report instead of blocking the calling thread.
+        The reader thread resolves an asyncio future on the running loop when the report arrives.
+
+        Args:
+            update_internal (bool): If True (default), updates self.current_pos.
+
+        Returns:
+            dict | None: Dictionary {'x': float, 'y': float, 'z': float, 'e': float}
+                         or None if sending/parsing fails or timeout occurs.
+        """
+        import asyncio # Only this coroutine needs it; keeps asyncio off the import path for sync users
+        log.info("Requesting position (M114, async)...")
+        loop = asyncio.get_running_loop()
+        report = loop.create_future()
+        def resolve(match):
+            if not report.done(): report.set_result(match)
+        def on_report(match): loop.call_soon_threadsafe(resolve, match) # Runs on the reader thread
+        token = self.comms.register_line_matcher(self.m114_pattern, on_report)
+        try:
+            # Sent by the handler's single async worker (an HTTP request over Wi-Fi may block briefly),
+            # which queues behind other async commands and holds the send lock like any send
+            if not await asyncio.wrap_future(self.comms.send_command_async("get_position")):
+                log.error("Failed to send M114 command."); return None
+            try: match = await asyncio.wait_for(report, self.POSITION_TIMEOUT)
+            except asyncio.TimeoutError: log.warning("Timed out waiting for position report."); return None
+        finally:
+            self.comms.unregister_line_matcher(token)
+
+        pos = self._parse_position(match)
+        if pos is None: return None
+        log.info("  Parsed position: %s", pos)
+        if update_internal: self.current_pos = pos
+        return pos
 
 
     def move_z(self, z: float, speed: float | None = None) -> bool:
         """Moves only the Z axis to the specified height."""
-        target_speed = self._get_speed(speed); print(f"\n[{time.strftime('%H:%M:%S')}] Moving Z to {z:.3f} at speed {target_speed or 'default'}")
+        target_speed = self._get_speed(speed); log.info("Moving Z to %.3f at speed %s", z, target_speed or 'default')
+        self.current_pos['z'] = None # Unknown until the move is confirmed: a failed or interrupted send may still have moved
         success = self.comms.send_command("move", Z=z, F=target_speed);
         if success: self.current_pos['z'] = z; # Optimistic update
         return success
 
     def move_xy(self, x: float, y: float, speed: float | None = None) -> bool:
         """Moves only the X and Y axes to the specified coordinates."""
-        print(x,y,speed)
-        target_speed = self._get_speed(speed); print(f"\n[{time.strftime('%H:%M:%S')}] Moving XY to ({x:.3f}, {y:.3f}) at speed {target_speed or 'default'}")
+        target_speed = self._get_speed(speed); log.info("Moving XY to (%.3f, %.3f) at speed %s", x, y, target_speed or 'default')
+        self.current_pos['x'] = None; self.current_pos['y'] = None # Unknown until the move is confirmed
         success = self.comms.send_command("move", X=x, Y=y, F=target_speed)
         if success: self.current_pos['x'] = x; self.current_pos['y'] = y; # Optimistic update
         return success
 
     def move_to(self, x: float, y: float, z: float, speed: float | None = None) -> bool:
-        """Moves safely to the target XYZ coordinates."""
-        target_speed = self._get_speed(speed); print(f"\n[{time.strftime('%H:%M:%S')}] Moving safely to ({x:.3f}, {y:.3f}, {z:.3f}) at speed {target_speed or 'default'}")
-        print("  Step 1: Moving to safe Z height..."); success = self.move_z(self.safe_z, target_speed)
-        if not success: print("  Error: Failed to move to safe Z height."); return False
-        print("  Step 2: Moving to target XY..."); success = self.move_xy(x, y, target_speed)
-        if not success: print("  Error: Failed to move to target XY."); return False
-        if not math.isclose(z, self.safe_z, abs_tol=1e-3):
-            print("  Step 3: Moving to target Z height..."); success = self.move_z(z, target_speed)
-            if not success: print("  Error: Failed to move to target Z height."); return False
-
+        """
+        Moves safely to the target XYZ coordinates: XY travel always happens at or above safe_z.
+        Hops that are not needed are skipped: no Z lift when the tracked Z is known and already at or
+        above safe_z, and XY + Z go out as one move when the target itself is at or above safe_z.
+        The tracked Z is cleared (None, so the lift happens) when a Robot move fails or homing starts;
+        Robot cannot see raw G-code sent straight to the handler, so follow that with get_position().
+        """
+        target_speed = self._get_speed(speed); log.info("Moving safely to (%.3f, %.3f, %.3f) at speed %s", x, y, z, target_speed or 'default')
+        tol = 1e-3
+        z_now = self.current_pos['z']
+        if z_now is not None and z_now >= self.safe_z - tol: log.info("  Step 1: Already at or above safe Z height.")
+        else:
+            log.info("  Step 1: Moving to safe Z height..."); success = self.move_z(self.safe_z, target_speed)
+            if not success: log.error("Failed to move to safe Z height."); return False
+        if z >= self.safe_z - tol:
+            # Start and end are both at or above safe Z, so the straight-line path is too
+            log.info("  Step 2: Moving to target XYZ in one move...")
+            self.current_pos['x'] = None; self.current_pos['y'] = None; self.current_pos['z'] = None # Unknown until confirmed
+            success = self.comms.send_command("move", X=x, Y=y, Z=z, F=target_speed)
+            if not success: log.error("Failed to move to target XYZ."); return False
+            self.current_pos['x'] = x; self.current_pos['y'] = y; self.current_pos['z'] = z # Optimistic update
         else:
-            print("  Step 3: Already at target Z height (safe Z)."); success = True
-        print(f"[{time.strftime('%H:%M:%S')}] Safe move finished. Overall Success: {success}"); return success
+            log.info("  Step 2: Moving to target XY..."); success = self.move_xy(x, y, target_speed)
+            if not success: log.error("Failed to move to target XY."); return False
+            log.info("  Step 3: Moving to target Z height..."); success = self.move_z(z, target_speed)
+            if not success: log.error("Failed to move to target Z height."); return False
+        log.info("Safe move finished. Overall Success: %s", success); return success
 
 
     def move_relative(self, dx: float = 0, dy: float = 0, dz: float = 0, speed: float | None = None) -> bool:
@@ -296,85 +426,118 @@ class Robot:
         Moves the robot by a relative amount in X, Y, or Z.
         """
         target_speed = self._get_speed(speed) # Use helper to get default speed if needed
-        print(f"\n[{time.strftime('%H:%M:%S')}] Moving relatively by (dX:{dx:.3f}, dY:{dy:.3f}, dZ:{dz:.3f}) at speed {target_speed or 'default'}")
-
-        # Build G-code command string parts
-        gcode_parts = ["G91"] # Set relative mode first
-        move_cmd = "G1"
-        has_move = False # Track if any axis is actually moving
-        if dx != 0: move_cmd += f" X{dx:.3f}"; has_move = True
-        if dy != 0: move_cmd += f" Y{dy:.3f}"; has_move = True
-        if dz != 0: move_cmd += f" Z{dz:.3f}"; has_move = True
-
-        # Only add the move command if there's movement, and add speed if specified
-        if has_move:
-            if target_speed is not None: move_cmd += f" F{target_speed:.1f}"
-            gcode_parts.append(move_cmd)
-
-        gcode_parts.append("G90") # Always set back to absolute mode
-
-        success = True
-        for cmd in gcode_parts:
-             if not self.comms.send_raw_gcode(cmd):
-                  success = False; print(f"  Error sending raw command: {cmd}"); break
-             time.sleep(0.05) # Small delay between raw commands
-
-        if success:
-             print("Relative move commands sent.")
-             # Update optimistic position if possible
-             if has_move and self.current_pos['x'] is not None:
-                 self.current_pos['x'] += dx
-                 self.current_pos['y'] += dy
-                 self.current_pos['z'] += dz
-        else:
-             print("Error sending relative move sequence.")
-             self.comms.send_raw_gcode("G90") # Ensure back to absolute
-
-        return success
+        log.info("Moving relatively by (dX:%.3f, dY:%.3f, dZ:%.3f) at speed %s", dx, dy, dz, target_speed or 'default')
+
+        # One write / HTTP request for G91, the move and G90 (the handler counts one window slot per line)
+        payload, encoded = _rel_move_gcode(dx, dy, dz, target_speed)
+        start_pos = dict(self.current_pos)
+        # Moved axes are unknown until the send is confirmed: a failed or interrupted send may still have moved
+        for axis, delta in (('x', dx), ('y', dy), ('z', dz)):
+            if delta: self.current_pos[axis] = None
+        success = False
+        try:
+            success = self.comms.send_raw_gcode(payload, encoded)
+        finally:
+            # The payload ends in G90; only a failed or interrupted send needs it again
+            if not success:
+                log.error("Error sending relative move sequence: %r", payload)
+                self.comms.send_raw_gcode("G90") # Ensure back to absolute
+        if not success: return False
+
+        log.info("Relative move commands sent.")
+        # Update optimistic position per axis (move_to relies on the tracked Z being current)
+        for axis, delta in (('x', dx), ('y', dy), ('z', dz)):
+            if delta and start_pos[axis] is not None: self.current_pos[axis] = start_pos[axis] + delta
+        return True
 
     def move_to_location(self, name: str, z_offset: float = 0.0, speed: float | None = None) -> bool:
         """
         Retrieves coordinates for a named location from the loaded dictionary and moves safely to it.
         """
-        print(f"\n[{time.strftime('%H:%M:%S')}] Moving to location '{name}' (Z offset: {z_offset:.3f})...")
-        # Get location directly from the internal dictionary loaded from JSON
-        location_coords = self.locations.get(name)
-
-        if location_coords is None:
-            print(f"Error: Location '{name}' not found in loaded locations ({self.locations_filepath}).")
-            return False
-        # Basic validation of the loaded dictionary structure
-        if not isinstance(location_coords, dict) or not all(key in location_coords for key in ('x', 'y', 'z')):
-             print(f"Error: Location '{name}' in {self.locations_filepath} has invalid format: {location_coords}")
-             return False
+        log.info("Moving to location '%s' (Z offset: %.3f)...", name, z_offset)
+        coords = self._loc_cache.get(name) # Validated on the first move to this name
+        if coords is None:
+            # Get location directly from the internal dictionary loaded from JSON
+            location_coords = self.locations.get(name)
+
+            if location_coords is None:
+                log.error("Location '%s' not found in loaded locations (%s).", name, self.locations_filepath)
+                return False
+            # Basic validation of the loaded dictionary structure
+            if not isinstance(location_coords, dict) or not all(key in location_coords for key in ('x', 'y', 'z')):
+                 log.error("Location '%s' in %s has invalid format: %s", name, self.locations_filepath, location_coords)
+                 return False
 
-        try:
-            target_x = float(location_coords['x'])
-            target_y = float(location_coords['y'])
-            target_z = float(location_coords['z']) + z_offset
-        except (ValueError, TypeError) as e:
-             print(f"Error: Invalid coordinate types for location '{name}': {e}")
-             return False
+            try:
+                coords = (float(location_coords['x']), float(location_coords['y']), float(location_coords['z']))
+            except (ValueError, TypeError) as e:
+                 log.error("Invalid coordinate types for location '%s': %s", name, e)
+                 return False
+            self._loc_cache[name] = coords
 
         # Call the safe move method
-        return self.move_to(target_x, target_y, target_z, speed)
+        target_x, target_y, target_z = coords
+        return self.move_to(target_x, target_y, target_z + z_offset, speed)
+
+    def _get_location_index(self) -> tuple:
+        """Returns (names, coords): self.locations as parallel tuples, skipping malformed entries."""
+        if self._location_index is None:
+            names = []; coords = []
+            for name, loc in self.locations.items():
+                try: coords.append((float(loc['x']), float(loc['y']), float(loc['z'])))
+                except (KeyError, TypeError, ValueError): continue
+                names.append(name)
+            self._location_index = (tuple(names), tuple(coords))
+        return self._location_index
+
+    def nearest_location(self, x: float, y: float, z: float) -> str | None:
+        """
+        Finds the named location closest to a point.
 
-    def add_location(self, name: str, x: float, y: float, z: float) -> bool:
-         """Adds or updates a named location and saves to the JSON file."""
-         if not isinstance(name, str) or not name: print("Error: Location name must be non-empty string."); return False
+        Args:
+            x, y, z (float): Query point in mm.
+
+        Returns:
+            str | None: Name of the nearest location (Euclidean distance), or None if none are loaded.
+        """
+        names, coords = self._get_location_index()
+        if not names: return None
+        point = (float(x), float(y), float(z))
+        best = min(range(len(coords)), key=lambda i: math.dist(coords[i], point))
+        return names[best]
+
+    def add_location(self, name: str, x: float, y: float, z: float, wait: bool = True) -> bool:
+         """
+         Adds or updates a named location and saves to the JSON file.
+
+         Args:
+             wait (bool): If True (default), waits up to SAVE_TIMEOUT for the file write. Pass False when
+                          recording many points in a row: the writes are coalesced in the background,
+                          and flush_locations() reports whether the last one succeeded.
+
+         Returns:
+             bool: True if the location was valid and (when waiting) the file was written.
+         """
+         if not isinstance(name, str) or not name: log.error("Location name must be non-empty string."); return False
          try:
-            coords = {'x': float(x), 'y': float(y), 'z': float(z)}; self.locations[name] = coords; print(f"Added/Updated location '{name}' in memory: {coords}")
-            if self._save_locations(): return True
-            else: print(f"Error: Failed to save locations file after updating '{name}'."); return False
-         except (ValueError, TypeError) as e: print(f"Error adding location '{name}': Invalid coordinates ({x}, {y}, {z}). {e}"); return False
+            coords = {'x': float(x), 'y': float(y), 'z': float(z)}; self.locations[name] = coords; self._location_index = None; self._loc_cache.pop(name, None); log.info("Added/Updated location '%s' in memory: %s", name, coords)
+            _queue_save(self.locations_filepath, dict(self.locations))
+            if not wait: return True # Write errors are logged by the writer
+            if self.flush_locations(self.SAVE_TIMEOUT): return True
+            else: log.error("Failed to save locations file after updating '%s'.", name); return False
+         except (ValueError, TypeError) as e: log.error("Error adding location '%s': Invalid coordinates (%s, %s, %s). %s", name, x, y, z, e); return False
+
+    def flush_locations(self, timeout: float | None = None) -> bool:
+        """Waits for queued add_location writes; True once locations_filepath holds the latest locations."""
+        return flush_saves(timeout, self.locations_filepath)
 
     def set_absolute_positioning(self) -> bool:
         """Sets the controller to absolute positioning mode (G90)."""
-        print(f"\n[{time.strftime('%H:%M:%S')}] Setting absolute positioning (G90)...");
+        log.info("Setting absolute positioning (G90)...");
         return self.comms.send_command("set_absolute")
 
     def set_relative_positioning(self) -> bool:
         """Sets the controller to relative positioning mode (G91)."""
-        print(f"\n[{time.strftime('%H:%M:%S')}] Setting relative positioning (G91)...");
+        log.info("Setting relative positioning (G91)...");
         return self.comms.send_command("set_relative")
 
@@ -1,9 +1,11 @@
-import time
-from comms.wifi_handler import WifiHandler
-from comms.serial_handler import SerialHandler
+import logging
+
+# Timestamps come from the logging formatter configured in Main.py
+log = logging.getLogger(__name__)
 
 class Sonicator:
     """Control the sonicator using the fan control G-code (Simplified)."""
+    __slots__ = ('comms',)
 
     # Simplified __init__ - removed type hint and check
     def __init__(self, comms):
@@ -31,26 +33,26 @@ class Sonicator:
         duration_ms = int(duration_s * 1000)
 
         # Send Command Sequence (minimal success checking)
-        print(f"\n[{time.strftime('%H:%M:%S')}] Running sonicator for: {duration_s} s")
-        print("  Turning sonicator ON...")
+        log.info("Running sonicator for: %s s", duration_s)
+        log.info("  Turning sonicator ON...")
         if not self.comms.send_command("fan_on"):
-            print("Error sending fan_on command.")
+            log.error("Error sending fan_on command.")
             return False # Exit early on failure
 
-        print(f"  Dwelling for {duration_s} seconds...")
+        log.info("  Dwelling for %s seconds...", duration_s)
         if not self.comms.send_command("dwell", duration_ms=duration_ms):
-            print("Error sending dwell command (or wait failed).")
+            log.error("Error sending dwell command (or wait failed).")
             # Attempt to turn off fan even if dwell failed
-            print("  Attempting to turn sonicator OFF after dwell failure...")
+            log.info("  Attempting to turn sonicator OFF after dwell failure...")
             self.comms.send_command("fan_off")
             return False # Return False as dwell failed
 
-        print("  Turning sonicator OFF...")
+        log.info("  Turning sonicator OFF...")
         if not self.comms.send_command("fan_off"):
-            print("Warning: Failed to send fan_off command, but dwell completed.")
+            log.warning("Failed to send fan_off command, but dwell completed.")
             # Return True because the main action (dwell) seemed to succeed
             # Change to False if fan_off failure is critical
             return True
 
-        print(f"[{time.strftime('%H:%M:%S')}] Sonicator run finished.")
+        log.info("Sonicator run finished.")
         return True
\ No newline at end of file